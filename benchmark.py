@@ -0,0 +1,613 @@
+"""Нагрузочный тест: синтетические апдейты через настоящие обработчики бота.
+
+Моделирует наплыв записи: тысячи пользователей одновременно жмут
+"Записаться" и "✅ Да", записывают и удаляют друзей, смотрят список.
+Апдейты проходят через Application.process_update со всеми обработчиками,
+а Bot API заменён заглушкой с настраиваемой задержкой. Сеть не нужна,
+поэтому тест можно запускать в CI.
+
+    python benchmark.py --users 2000 --concurrency 200 --api-latency 0.02
+
+С --http заглушка работает как HTTP-сервер на localhost, а бот ходит к
+ней через настоящие пулы соединений (см. transport) и параллельно опрашивает
+getUpdates. Так видно, как размер пула, keep-alive и версия HTTP влияют
+на время ответа:
+
+    BOT_API_POOL_SIZE=4 python benchmark.py --http
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from typing import Any
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+BOT_ID = 1
+CHAT_ID = -1000
+# Границы корзин гистограммы задержек, мс
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FakeBotApi(BaseRequest):
+    """Заглушка Bot API: отвечает на все методы с заданной задержкой"""
+
+    # Сколько секунд держать getUpdates вместо timeout из запроса, чтобы
+    # остановка опроса не ждала его целиком
+    POLL_WAIT = 1.0
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        # Последняя inline-клавиатура, отправленная в каждый чат
+        self.keyboards: dict[int, list[list[dict]]] = {}
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        return 200, await self.respond(endpoint, params)
+
+    async def respond(self, endpoint: str, params: dict[str, Any]) -> bytes:
+        self.calls[endpoint] += 1
+        if endpoint == "getUpdates":
+            # Апдейты подаются напрямую, опрос всегда пустой
+            timeout = float(params.get("timeout") or 0)
+            await asyncio.sleep(min(timeout, self.POLL_WAIT))
+            return json.dumps({"ok": True, "result": []}).encode()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self._result(endpoint, params)
+        return json.dumps({"ok": True, "result": result}).encode()
+
+    def _result(self, endpoint: str, params: dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return {
+                "id": BOT_ID, "is_bot": True, "first_name": "Benchmark",
+                "username": "benchmark_bot"
+            }
+        if endpoint in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", CHAT_ID))
+            markup = params.get("reply_markup")
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            if isinstance(markup, dict) and "inline_keyboard" in markup:
+                self.keyboards[chat_id] = markup["inline_keyboard"]
+            self._message_id += 1
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", "")
+            }
+        return True
+
+
+class FakeBotApiServer:
+    """FakeBotApi за HTTP-сервером на localhost.
+
+    Считает соединения, открытые ботом: с keep-alive их столько, сколько
+    запросов одновременно было в работе, а не столько, сколько вызовов.
+    """
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+        self.peers: set[Any] = set()
+        self._runner: Any = None
+
+    async def start(self) -> str:
+        """Запускает сервер и возвращает его адрес для BOT_API_URL"""
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        body = await self.api.respond(request.match_info["method"], params)
+        return web.Response(body=body, content_type="application/json")
+
+
+class LoopLagMonitor:
+    """Измеряет, насколько цикл событий опаздывает с пробуждением"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(
+                time.perf_counter() - started - self.interval
+            )
+
+
+class UpdateFactory:
+    """Собирает JSON апдейтов так, как их прислал бы Telegram"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict[str, Any]:
+        return {
+            "id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+            "last_name": "Load", "username": f"user{user_id}"
+        }
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = self._next_id()
+        data = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text
+            }
+        }
+        update = Update.de_json(data, self.bot)
+        assert update is not None
+        return update
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = self._next_id()
+        payload = {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {
+                        "id": BOT_ID, "is_bot": True,
+                        "first_name": "Benchmark"
+                    },
+                    "text": "..."
+                }
+            }
+        }
+        update = Update.de_json(payload, self.bot)
+        assert update is not None
+        return update
+
+
+class Benchmark:
+    def __init__(self, app, api: FakeBotApi, args: argparse.Namespace):
+        self.app = app
+        self.api = api
+        self.args = args
+        self.factory = UpdateFactory(app.bot)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.rng = random.Random(args.seed)
+
+    async def send(self, label: str, update: Update) -> None:
+        started = time.perf_counter()
+        await self.app.process_update(update)
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def user_script(self, user_id: int) -> None:
+        rng = self.rng
+        message = self.factory.message
+        if rng.random() < self.args.list_ratio:
+            await self.send("list", message(user_id, "🫂 Список игроков"))
+        await self.send("signup", message(user_id, "🏃‍♂️‍➡️ Записаться"))
+        await self.send("confirm", message(user_id, "✅ Да"))
+        if rng.random() < self.args.friend_ratio:
+            for number in range(self.args.friends):
+                await self.send(
+                    "friend_add", message(user_id, "👥 Записать друга")
+                )
+                await self.send(
+                    "friend_name",
+                    message(user_id, f"Friend{user_id}_{number}")
+                )
+            if rng.random() < self.args.delete_ratio:
+                await self.send(
+                    "friend_menu", message(user_id, "🗑 Удалить друга")
+                )
+                keyboard = self.api.keyboards.pop(user_id, None)
+                if keyboard:
+                    await self.delete_friends(user_id, keyboard)
+        if rng.random() < self.args.list_ratio:
+            await self.send("list", message(user_id, "🫂 Список игроков"))
+
+    async def delete_friends(
+        self, user_id: int, keyboard: list[list[dict]]
+    ) -> None:
+        """Удаляет одного друга или, с вероятностью --delete-all-ratio,
+        всех сразу (кнопка и подтверждение)"""
+        callback = self.factory.callback
+        buttons = [button["callback_data"] for row in keyboard
+                   for button in row]
+        delete_all = [data for data in buttons
+                      if data.startswith("friends_all:")]
+        if delete_all and self.rng.random() < self.args.delete_all_ratio:
+            await self.send(
+                "friends_all", callback(user_id, delete_all[0])
+            )
+            confirm = self.api.keyboards.pop(user_id, None)
+            if confirm:
+                await self.send(
+                    "friends_all_ok",
+                    callback(user_id, confirm[0][0]["callback_data"])
+                )
+            return
+        await self.send("friend_delete", callback(user_id, buttons[0]))
+
+    async def run(self) -> float:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(user_id: int) -> None:
+            async with semaphore:
+                await self.user_script(user_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            limited(100000 + i) for i in range(self.args.users)
+        ))
+        return time.perf_counter() - started
+
+
+class CountingStorage:
+    """Обёртка над хранилищем, считающая вызовы записи"""
+
+    WRITES = ("append_changes", "write_players", "save_state",
+              "archive_game")
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.calls: Counter[str] = Counter()
+        self.records = 0
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._backend, name)
+        if name not in self.WRITES:
+            return attr
+
+        def counted(*args, **kwargs):
+            self.calls[name] += 1
+            if name == "append_changes":
+                self.records += len(args[1])
+            return attr(*args, **kwargs)
+        return counted
+
+
+def histogram(values: list[float]) -> str:
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for value in values:
+        ms = value * 1000
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = [f"≤{b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+    return " ".join(
+        f"{label}:{count}" for label, count in zip(labels, counts) if count
+    )
+
+
+def build_report(
+    bench: Benchmark,
+    elapsed: float,
+    lags: list[float],
+    storage: CountingStorage,
+    outbound
+) -> dict[str, Any]:
+    total = sum(len(v) for v in bench.latencies.values())
+    handlers = {}
+    for label, values in sorted(bench.latencies.items()):
+        handlers[label] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000,
+            "histogram": histogram(values),
+        }
+    return {
+        "users": bench.args.users,
+        "updates": total,
+        "elapsed_s": elapsed,
+        "throughput_ups": total / elapsed if elapsed else 0.0,
+        "handlers": handlers,
+        "loop_lag_ms": {
+            "p50": percentile(lags, 50) * 1000,
+            "p99": percentile(lags, 99) * 1000,
+            "max": max(lags, default=0.0) * 1000,
+        },
+        "storage_writes": dict(storage.calls),
+        "storage_records": storage.records,
+        "api_calls": dict(bench.api.calls),
+        "announcements": {
+            "sent": outbound.sent,
+            "failed": outbound.failed,
+            "pending": outbound.pending,
+        },
+    }
+
+
+def print_report(report: dict[str, Any]) -> None:
+    print(
+        f"\n👥 Пользователей: {report['users']}, "
+        f"апдейтов: {report['updates']}, "
+        f"время: {report['elapsed_s']:.2f} с, "
+        f"пропускная способность: {report['throughput_ups']:.0f} апд/с"
+    )
+    print(f"\n{'обработчик':<14}{'кол-во':>8}{'p50':>9}{'p90':>9}"
+          f"{'p99':>9}{'max':>9}  (мс)")
+    for label, h in report["handlers"].items():
+        print(
+            f"{label:<14}{h['count']:>8}{h['p50_ms']:>9.2f}"
+            f"{h['p90_ms']:>9.2f}{h['p99_ms']:>9.2f}{h['max_ms']:>9.2f}"
+        )
+        print(f"{'':<14}{h['histogram']}")
+    lag = report["loop_lag_ms"]
+    print(
+        f"\n⏱ Задержка цикла событий, мс: p50 {lag['p50']:.2f}, "
+        f"p99 {lag['p99']:.2f}, max {lag['max']:.2f}"
+    )
+    print(
+        f"💾 Запись в хранилище: {report['storage_writes']}, "
+        f"изменений: {report['storage_records']}"
+    )
+    print(f"📡 Вызовы Bot API: {report['api_calls']}")
+    print(f"📢 Объявления: {report['announcements']}")
+    if "api_http" in report:
+        http = report["api_http"]
+        print(f"🔌 Соединений с Bot API: {http['connections']}")
+        for endpoint, e in http["endpoints"].items():
+            print(
+                f"{'':<3}{endpoint:<28}{e['count']:>8}"
+                f"{e['mean_ms']:>9.2f} мс в среднем"
+            )
+
+
+def api_http_report(server: FakeBotApiServer) -> dict[str, Any]:
+    """Замеры транспорта бота по методам Bot API"""
+    from metrics import BOT_API_SECONDS
+
+    endpoints = {}
+    for labels in sorted(
+        BOT_API_SECONDS.labelsets(), key=lambda labels: labels["endpoint"]
+    ):
+        count = BOT_API_SECONDS.count(**labels)
+        endpoints[f"{labels['pool']}:{labels['endpoint']}"] = {
+            "count": count,
+            "mean_ms": BOT_API_SECONDS.total(**labels) / count * 1000,
+        }
+    return {"connections": len(server.peers), "endpoints": endpoints}
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    api = FakeBotApi(args.api_latency)
+    server = None
+    if args.http:
+        server = FakeBotApiServer(api)
+        # Адрес Bot API бот читает при импорте
+        os.environ["BOT_API_URL"] = await server.start()
+
+    import bot
+    from outbound import TokenBucket
+
+    logging.getLogger().setLevel(args.log_level)
+    session = bot.registry.default
+    session.max_players = args.max_players
+    storage = CountingStorage(session.storage)
+    for s in bot.registry:
+        s.storage = s.persistence.storage = storage  # type: ignore
+    # Лимиты Telegram заглушке не нужны: и общий, и на чат поднимаются
+    bot.outbound.chat_rate = bot.outbound.chat_burst = args.announce_rate
+    bot.outbound.global_bucket = TokenBucket(
+        args.announce_rate, args.announce_rate
+    )
+
+    app = bot.build_application(None if server else api)
+    await bot.registry.load_all()
+    monitor = LoopLagMonitor()
+    # Порядок запуска и остановки тот же, что у run_polling: очередь
+    # объявлений дописывается в on_stop, пока клиент Bot API открыт
+    await app.initialize()
+    await bot.on_startup(app)
+    updater = app.updater
+    if server and updater is not None:
+        await updater.start_polling(timeout=bot.POLLING_TIMEOUT)
+    await app.start()
+    monitor.start()
+    bench = Benchmark(app, api, args)
+    elapsed = await bench.run()
+    await monitor.stop()
+    # Работающий бот успевает отправить очередь; остаток дописывается
+    # при остановке
+    await bot.outbound.flush(timeout=args.drain_timeout)
+    if updater is not None and updater.running:
+        await updater.stop()
+    await app.stop()
+    await bot.on_stop(app)
+    await app.shutdown()
+    await bot.on_shutdown(app)
+    report = build_report(
+        bench, elapsed, monitor.lags, storage, bot.outbound
+    )
+    if server:
+        await server.stop()
+        report["api_http"] = api_http_report(server)
+    return report
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100,
+                        help="сколько пользователей действуют одновременно")
+    parser.add_argument("--api-latency", type=float, default=0.01,
+                        help="задержка ответа Bot API, с")
+    parser.add_argument("--max-players", type=int, default=12)
+    parser.add_argument("--friend-ratio", type=float, default=0.2)
+    parser.add_argument("--friends", type=int, default=1,
+                        help="сколько друзей записывает пользователь")
+    parser.add_argument("--delete-ratio", type=float, default=0.5)
+    parser.add_argument("--delete-all-ratio", type=float, default=0.5,
+                        help="доля удалений кнопкой 'удалить всех'")
+    parser.add_argument("--list-ratio", type=float, default=0.5)
+    parser.add_argument("--announce-rate", type=float, default=1000,
+                        help="лимит объявлений в чат игры, сообщений/с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=("json", "sqlite"),
+                        default="json")
+    parser.add_argument("--shared", choices=("", "memory", "sqlite"),
+                        default="",
+                        help="общее состояние реплик (требует "
+                             "--storage sqlite)")
+    parser.add_argument("--http", action="store_true",
+                        help="обращаться к заглушке Bot API по HTTP "
+                             "через настоящие пулы соединений")
+    parser.add_argument("--json", dest="json_path",
+                        help="сохранить отчёт в JSON-файл")
+    parser.add_argument("--max-p99-ms", type=float,
+                        help="завершиться с ошибкой, если p99 любого "
+                             "обработчика выше порога или действие "
+                             "сценария ни разу не выполнилось")
+    parser.add_argument("--drain-timeout", type=float, default=10,
+                        help="сколько секунд после сценария ждать отправки "
+                             "объявлений до остановки бота")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def expected_actions(args: argparse.Namespace) -> set[str]:
+    """Действия, которые должны встретиться при заданных долях"""
+    actions = {"signup", "confirm"}
+    if args.list_ratio > 0:
+        actions.add("list")
+    if args.friend_ratio > 0 and args.friends > 0:
+        actions |= {"friend_add", "friend_name"}
+        if args.delete_ratio > 0:
+            actions.add("friend_menu")
+            if args.delete_all_ratio < 1:
+                actions.add("friend_delete")
+            if args.delete_all_ratio > 0 and args.friends > 1:
+                actions |= {"friends_all", "friends_all_ok"}
+    return actions
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    data_dir = tempfile.mkdtemp(prefix="vb-bench-")
+    # Настройки бота читаются при импорте, поэтому задаём их заранее
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+        "ADMIN_CHAT_ID": "1",
+        "ORGANIZER_CHAT_ID": "2",
+        "VOLLEYBALL_CHAT_ID": str(CHAT_ID),
+        "PAYMENT_INFORMATION": "benchmark",
+        "DATA_DIR": data_dir,
+        "STORAGE_BACKEND": args.storage,
+        "SHARED_STATE": args.shared,
+        "BOT_MODE": "polling",
+        "HEALTH_FILE": "",
+    })
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_p99_ms is not None:
+        # Порог p99 ничего не проверяет для действий, до которых сценарий
+        # не дошёл (например, друзей не записать при маленьком лимите)
+        missing = expected_actions(args) - set(report["handlers"])
+        if missing:
+            print(f"\n❌ Нет замеров для: {', '.join(sorted(missing))}")
+            return 1
+        slow = {
+            label: h["p99_ms"] for label, h in report["handlers"].items()
+            if h["p99_ms"] > args.max_p99_ms
+        }
+        if slow:
+            print(f"\n❌ p99 выше {args.max_p99_ms} мс: {slow}")
+            return 1
+    announcements = report["announcements"]
+    if announcements["pending"] or announcements["failed"]:
+        print(
+            f"\n❌ Объявления не доставлены после остановки: "
+            f"в очереди {announcements['pending']}, "
+            f"ошибок {announcements['failed']}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
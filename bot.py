@@ -1,151 +1,248 @@
 import os
-import json
 import datetime
 import asyncio
 import logging
+import signal
 import re
+import io
+import json
+import time
+from functools import partial, wraps
+from typing import TYPE_CHECKING
+# Первым из своих модулей: отсчёт запуска включает импорт библиотек
+from health import Health, StartupTimer
 from telegram import (
     Update, ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
-    CallbackQueryHandler, ContextTypes, filters
+    Application, ApplicationBuilder, CommandHandler, MessageHandler,
+    CallbackQueryHandler, ContextTypes, TypeHandler, filters
 )
+from telegram.request import BaseRequest
+from storage import DEFAULT_GAME, create_storage
+from session import GameSession, SessionRegistry, Signup, parse_games
+from ledger import PlayerStats
+from roster import friend_callback_data
+from scheduler import Job, Scheduler, WeeklyRule, get_timezone
+from outbound import OutboundDispatcher
+from conversation import Step
+from transport import create_requests
+from metrics import (
+    HANDLER_ERRORS, HANDLER_SECONDS, UPDATES, MetricsServer, Profiler
+)
+from logs import configured_levels, set_levels, setup_logging, update_context
+
+# Модули для редко включаемых режимов (закреплённый список, несколько
+# реплик) и команд администратора импортируются там, где используются
+if TYPE_CHECKING:
+    from shared import SharedStore
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Настройка логирования: запись в поток вывода выполняет отдельный поток.
+# LOG_LEVELS задаёт уровни по модулям, например "storage=DEBUG"; по
+# умолчанию скрыты строки httpx о каждом запросе к Bot API
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "text"),
+    levels=os.getenv("LOG_LEVELS", "httpx=WARNING"),
+    burst=int(os.getenv("LOG_RATE_BURST", "20")),
+    window=float(os.getenv("LOG_RATE_WINDOW", "10"))
 )
-logger = logging.getLogger(__name__)
+# Имя не зависит от того, запущен модуль скриптом или импортирован
+logger = logging.getLogger("bot")
+startup = StartupTimer()
+startup.mark("imports")
 
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 if not BOT_TOKEN:
     raise ValueError(
         "TELEGRAM_BOT_TOKEN not found in environment variables. Please set it."
     )
 
-ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
+# Хранилище данных: json (по умолчанию) или sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+
+# Получение апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес webhook; если пуст, setWebhook не вызывается
+# (например, при локальной проверке или ручной настройке)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError(
+        "WEBHOOK_SECRET not found in environment variables. "
+        "It is required when BOT_MODE=webhook."
+    )
+
+ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID", "")
 if not ADMIN_CHAT_ID:
     raise ValueError(
         "ADMIN_CHAT_ID not found in environment variables. Please set it."
     )
 
-VOLLEYBALL_CHAT_ID = os.getenv("VOLLEYBALL_CHAT_ID")
+VOLLEYBALL_CHAT_ID = os.getenv("VOLLEYBALL_CHAT_ID", "")
 if not VOLLEYBALL_CHAT_ID:
     raise ValueError(
         "VOLLEYBALL_CHAT_ID not found in environment variables. Please set it."
     )
 
-ORGANIZER_CHAT_ID = os.getenv("ORGANIZER_CHAT_ID")
+ORGANIZER_CHAT_ID = os.getenv("ORGANIZER_CHAT_ID", "")
 if not ORGANIZER_CHAT_ID:
     raise ValueError(
         "ORGANIZER_CHAT_ID not found in environment variables. Please set it."
     )
 
-PAYMENT_INFORMATION = os.getenv("PAYMENT_INFORMATION")
+PAYMENT_INFORMATION = os.getenv("PAYMENT_INFORMATION", "")
 if not PAYMENT_INFORMATION:
     raise ValueError(
         "PAYMENT_INFORMATION not found in environment variables. "
         "Please set it."
     )
 
-DATA_FILE = "/app/data/players.json"
-STATE_FILE = "/app/data/bot_state.json"
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+DATA_FILE = os.path.join(DATA_DIR, "players.json")
+STATE_FILE = os.path.join(DATA_DIR, "bot_state.json")
+HISTORY_FILE = os.path.join(DATA_DIR, "games.jsonl")
+SQLITE_FILE = os.path.join(DATA_DIR, "bot.sqlite3")
+CONVERSATIONS_FILE = os.path.join(DATA_DIR, "conversations.json")
+PAYMENTS_FILE = os.path.join(DATA_DIR, "payments.jsonl")
 GAME_DAY = "воскресенье"
-
-# Инициализация глобальных переменных
-players: list[dict[str, str | int]] = []
-pending_confirmations: set[int] = set()
-pending_add_friend: set[int] = set()
 MAX_PLAYERS = 12
-waiting_organizer_response = False
-waiting_payment_amount = False
-REGISTRATION_OPEN = True
 
+# Дополнительные игры в других чатах (JSON-список, см. parse_games)
+GAMES = os.getenv("GAMES", "")
+# Расписание игры по умолчанию (JSON-объект), например
+# {"close": "fri 11:00", "organizer": "sun 18:00", "cleanup": "sun 22:00"}
+SCHEDULE = os.getenv("SCHEDULE", "")
+# Часовой пояс расписания (IANA), по умолчанию часовой пояс системы
+TIMEZONE = os.getenv("TIMEZONE", "")
+# Сколько апдейтов обрабатывать одновременно; 0 - по одному (как раньше).
+# Апдейты одного пользователя в любом случае обрабатываются по очереди.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "0"))
+# Окно (в секундах), в течение которого объявления о записи и отписке
+# склеиваются в одно сообщение; 0 - отправлять по одному
+ANNOUNCE_MERGE_WINDOW = float(os.getenv("ANNOUNCE_MERGE_WINDOW", "0"))
 
-def load_players():
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            players[:] = data
-            logger.info("✅ Игроки загружены из файла.")
-    except FileNotFoundError:
-        logger.info("📭 Файл игроков не найден, создаем пустой список")
-        players.clear()
-    except Exception as e:
-        logger.error(f"❌ Ошибка загрузки игроков: {e}")
-        players.clear()
-
-
-def save_players():
-    try:
-        # Создаем директорию, если не существует
-        os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(players, f, ensure_ascii=False)
-        logger.info(f"💾 Игроки сохранены. Всего: {len(players)}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения игроков: {e}")
-
-
-def load_bot_state():
-    """Загружает состояние бота (открыта/закрыта запись)"""
-    global REGISTRATION_OPEN
-    try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            state = json.load(f)
-            REGISTRATION_OPEN = state.get('registration_open', True)
-            status = 'открыта' if REGISTRATION_OPEN else 'закрыта'
-            logger.info(f"✅ Состояние бота загружено. Запись: {status}")
-    except FileNotFoundError:
-        REGISTRATION_OPEN = True
-        logger.info("📭 Файл состояния не найден, устанавливаем по умолчанию")
-        # Сохраняем состояние по умолчанию
-        save_bot_state()
-    except Exception as e:
-        REGISTRATION_OPEN = True
-        error_msg = (
-            f"❌ Ошибка загрузки состояния: {e}, "
-            f"устанавливаем по умолчанию"
-        )
-        logger.error(error_msg)
-        save_bot_state()
-
-
-def save_bot_state():
-    """Сохраняет состояние бота"""
-    try:
-        # Создаем директорию, если не существует
-        directory = os.path.dirname(STATE_FILE)
-        os.makedirs(directory, exist_ok=True)
-
-        state = {
-            'registration_open': REGISTRATION_OPEN,
-            'last_updated': datetime.datetime.now().isoformat()
-        }
-
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-
-        status = 'открыта' if REGISTRATION_OPEN else 'закрыта'
-        logger.info(f"💾 Состояние бота сохранено. Запись: {status}")
-
-        # Проверяем, что файл действительно создался
-        if os.path.exists(STATE_FILE):
-            file_size = os.path.getsize(STATE_FILE)
-            success_msg = (
-                f"✅ Файл состояния создан успешно. "
-                f"Размер: {file_size} байт"
-            )
-            logger.info(success_msg)
-        else:
-            logger.error("❌ Файл состояния не создан!")
+# Режим закреплённого списка: одно сообщение в чате игры, которое
+# редактируется при изменениях вместо отдельных объявлений
+LIVE_ROSTER = os.getenv("LIVE_ROSTER", "0") == "1"
+# Через сколько секунд после первого изменения обновлять сообщение
+LIVE_ROSTER_DELAY = float(os.getenv("LIVE_ROSTER_DELAY", "3"))
+
+# Сколько секунд бот ждёт ответа пользователя (подтверждение записи,
+# имя друга) и сколько незавершённых диалогов держит в памяти
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "600"))
+CONVERSATION_LIMIT = int(os.getenv("CONVERSATION_LIMIT", "10000"))
+# Организатор может ответить на вопрос об игре позже
+ORGANIZER_TTL = 2 * 24 * 3600
+# Сколько строк выводят команды администратора (/stats, /debts)
+ADMIN_LIST_LIMIT = 50
+# Сколько друзей на одной странице клавиатуры удаления
+FRIENDS_PAGE_SIZE = 8
+# Максимальный размер файла для /import
+IMPORT_MAX_BYTES = 1024 * 1024
+# Максимальный размер выгрузки /export: PTB читает отправляемый файл в
+# память целиком, а Bot API принимает файлы до 50 МБ
+EXPORT_MAX_BYTES = 20 * 1024 * 1024
+
+# HTTP-транспорт к Bot API: размер пула соединений для обычных вызовов
+# и отдельного - для getUpdates, версия HTTP (2 требует пакет h2),
+# сколько секунд держать простаивающее соединение и таймауты запросов
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "64"))
+POLLING_POOL_SIZE = int(os.getenv("POLLING_POOL_SIZE", "1"))
+BOT_API_HTTP_VERSION = os.getenv("BOT_API_HTTP_VERSION", "1.1")
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", "30"))
+BOT_API_CONNECT_TIMEOUT = float(os.getenv("BOT_API_CONNECT_TIMEOUT", "5"))
+BOT_API_READ_TIMEOUT = float(os.getenv("BOT_API_READ_TIMEOUT", "5"))
+BOT_API_WRITE_TIMEOUT = float(os.getenv("BOT_API_WRITE_TIMEOUT", "5"))
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "5"))
+# Сколько секунд Telegram держит запрос getUpdates без новых апдейтов
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "10"))
+
+# Порт эндпоинта /metrics (0 - выключен); по умолчанию слушает только
+# localhost
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+# Файл готовности для healthcheck (пусто - не создавать)
+HEALTH_FILE = os.getenv("HEALTH_FILE", "/tmp/bot.ready")
+
+# Несколько реплик с общим состоянием: sqlite (общий файл SQLITE_FILE)
+# или memory (внутри процесса, для проверок); пусто - одна реплика
+SHARED_STATE = os.getenv("SHARED_STATE", "")
+REPLICA_ID = os.getenv("REPLICA_ID", "")
+# Через сколько секунд после падения лидера расписание подхватит
+# другая реплика
+LEADER_TTL = float(os.getenv("LEADER_TTL", "30"))
+if SHARED_STATE not in ("", "sqlite", "memory"):
+    raise ValueError(
+        f"Неизвестный SHARED_STATE: {SHARED_STATE!r} "
+        f"(ожидается sqlite или memory)"
+    )
+if SHARED_STATE and STORAGE_BACKEND != "sqlite":
+    raise ValueError("SHARED_STATE требует STORAGE_BACKEND=sqlite")
+
+# Инициализация хранилища и игр
+storage = create_storage(
+    STORAGE_BACKEND, DATA_FILE, STATE_FILE, HISTORY_FILE, SQLITE_FILE,
+    CONVERSATIONS_FILE, PAYMENTS_FILE
+)
+registry = SessionRegistry(CONVERSATION_TTL, CONVERSATION_LIMIT)
+registry.add(GameSession(
+    DEFAULT_GAME, VOLLEYBALL_CHAT_ID, storage, MAX_PLAYERS, GAME_DAY,
+    schedule=json.loads(SCHEDULE) if SCHEDULE else None
+))
+for game in parse_games(GAMES) if GAMES else []:
+    registry.add(GameSession(
+        game['id'],
+        str(game['chat_id']),
+        storage,
+        game.get('max_players', MAX_PLAYERS),
+        game.get('game_day', GAME_DAY),
+        game.get('title', ''),
+        game.get('schedule')
+    ))
+scheduler = Scheduler(get_timezone(TIMEZONE))
+shared_store: "SharedStore | None" = None
+leader: "LeaderElection | None" = None
+if SHARED_STATE:
+    from shared import (
+        LeaderElection, MemoryStore, SqliteStore, default_replica_id
+    )
+
+    REPLICA_ID = REPLICA_ID or default_replica_id()
+    shared_store = (
+        SqliteStore(SQLITE_FILE) if SHARED_STATE == "sqlite"
+        else MemoryStore()
+    )
+    registry.share(shared_store, REPLICA_ID)
+    leader = LeaderElection(
+        shared_store, REPLICA_ID, LEADER_TTL,
+        on_change=lambda is_leader: on_leadership(is_leader)
+    )
+outbound = OutboundDispatcher(merge_window=ANNOUNCE_MERGE_WINDOW)
+health = Health(startup, HEALTH_FILE)
+metrics_server = (
+    MetricsServer(
+        host=METRICS_LISTEN, port=METRICS_PORT, ready=health.is_ready
+    )
+    if METRICS_PORT else None
+)
+profiler = Profiler()
+live_roster: "LiveRoster | None" = None
+if LIVE_ROSTER:
+    from live import LiveRoster
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения состояния: {e}")
-        logger.error(f"❌ Тип ошибки: {type(e).__name__}")
+    live_roster = LiveRoster(
+        lambda session: roster_text(session), LIVE_ROSTER_DELAY
+    )
+    for session in registry:
+        live_roster.watch(session)
+startup.mark("init")
 
 
 main_keyboard = ReplyKeyboardMarkup(
@@ -159,415 +256,1466 @@ main_keyboard = ReplyKeyboardMarkup(
     ],
     resize_keyboard=True
 )
+# Клавиатуры неизменяемы, поэтому создаются один раз
+confirm_keyboard = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton("✅ Да"), KeyboardButton("❌ Нет")]],
+    resize_keyboard=True
+)
+organizer_keyboard = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton("Да"), KeyboardButton("Нет")]],
+    resize_keyboard=True
+)
+
+
+def serialized_per_user(handler):
+    """Обрабатывает апдейты одного пользователя строго по очереди.
+
+    Нужно при concurrent_updates, чтобы "Записаться" и "✅ Да" одного
+    пользователя не обработались в обратном порядке.
+    """
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None:
+            return await handler(update, context)
+        async with registry.user_locks.hold(user.id):
+            return await handler(update, context)
+    return wrapper
+
+
+def instrumented(name: str):
+    """Считает апдейты, время и ошибки обработчика для /metrics.
+
+    Ветку внутри обработчика он сам уточняет через set_branch.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(
+            update: Update, context: ContextTypes.DEFAULT_TYPE
+        ):
+            labels = {
+                'update_id': update.update_id,
+                'chat_id': getattr(update.effective_chat, 'id', None),
+                'user_id': getattr(update.effective_user, 'id', None),
+                'handler': name,
+            }
+            token = update_context.set(labels)
+            started = time.perf_counter()
+            try:
+                return await handler(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                label = labels['handler']
+                UPDATES.inc(handler=name, branch=label)
+                HANDLER_SECONDS.observe(elapsed, handler=name, branch=label)
+                logger.debug(
+                    "Апдейт обработан за %.1f мс", elapsed * 1000,
+                    extra={'duration_ms': round(elapsed * 1000, 2)}
+                )
+                update_context.reset(token)
+        return wrapper
+    return decorator
+
+
+def set_branch(label: str) -> None:
+    """Ветка текущего обработчика для метрик и логов"""
+    labels = update_context.get()
+    if labels is not None:
+        labels['handler'] = label
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /profile: включение и выключение профилировщика.
+
+    Доступна только в чате администратора. Отчёт приходит файлом.
+    """
+    message = update.message
+    if message is None:
+        return
+    if not is_admin(update):
+        return
+    if not profiler.running:
+        profiler.start()
+        await message.reply_text(
+            f"🔬 Профилирование ({profiler.engine}) включено. "
+            "Повторите /profile, чтобы получить отчёт."
+        )
+        return
+    report = profiler.stop()
+    await message.reply_document(
+        document=io.BytesIO(report.encode()),
+        filename=f"profile-{datetime.datetime.now():%Y%m%d-%H%M%S}.txt",
+        caption="🔬 Профилирование остановлено"
+    )
+
+
+async def loglevel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /loglevel [модуль=УРОВЕНЬ ...]: уровни логирования.
+
+    Без аргументов показывает текущие уровни, например
+    /loglevel storage=DEBUG httpx=INFO.
+    """
+    message = update.message
+    if message is None:
+        return
+    if not is_admin(update):
+        return
+    if context.args:
+        try:
+            set_levels(",".join(context.args))
+        except ValueError as e:
+            await message.reply_text(f"⚠️ {e}")
+            return
+        logger.warning("🔧 Уровни логирования изменены: %s", context.args)
+    levels = configured_levels()
+    await message.reply_text(
+        "🔧 Уровни логирования:\n"
+        + "\n".join(f"{name}: {level}" for name, level in levels.items())
+    )
+
+
+def is_admin(update: Update) -> bool:
+    chat = update.effective_chat
+    return chat is not None and str(chat.id) == ADMIN_CHAT_ID
+
+
+def is_staff(update: Update) -> bool:
+    """Чат администратора или организатора"""
+    chat = update.effective_chat
+    return chat is not None and str(chat.id) in (
+        ADMIN_CHAT_ID, ORGANIZER_CHAT_ID
+    )
+
+
+def admin_session(update: Update) -> GameSession:
+    """Игра для команды администратора: выбранная через /game"""
+    chat = update.effective_chat
+    user = update.effective_user
+    if chat is None or user is None:
+        return registry.default
+    return registry.route(chat.id, user.id)
+
+
+def player_line(session: GameSession, key: str, stats: PlayerStats) -> str:
+    name = stats.name or f"id {key}"
+    if stats.username:
+        name += f" (@{stats.username})"
+    return (
+        f"{name}: игр {stats.played}, "
+        f"посещаемость {session.ledger.attendance(stats):.0%}, "
+        f"долг {stats.balance} ₽"
+    )
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /stats [id|@username]: итоги игроков или одного игрока"""
+    message = update.message
+    if message is None:
+        return
+    if not is_admin(update):
+        return
+    session = admin_session(update)
+    ledger = session.ledger
+    if context.args:
+        found = ledger.find(context.args[0])
+        if found is None:
+            await message.reply_text("⚠️ Игрок не найден.")
+            return
+        await message.reply_text(player_line(session, *found))
+        return
+    if not len(ledger):
+        await message.reply_text("📭 Сыгранных игр пока нет.")
+        return
+    lines = [
+        player_line(session, key, stats)
+        for key, stats in ledger.top()[:ADMIN_LIST_LIMIT]
+    ]
+    await message.reply_text(
+        f"📊 {session.title}: сыграно игр {ledger.games_held}\n\n"
+        + "\n".join(lines)
+    )
+
+
+async def debts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /debts: кто не оплатил сыгранные игры"""
+    message = update.message
+    if message is None:
+        return
+    if not is_admin(update):
+        return
+    session = admin_session(update)
+    debtors = session.ledger.debtors()
+    if not debtors:
+        await message.reply_text("✅ Все игры оплачены.")
+        return
+    total = sum(stats.balance for _, stats in debtors)
+    lines = [
+        player_line(session, key, stats)
+        for key, stats in debtors[:ADMIN_LIST_LIMIT]
+    ]
+    await message.reply_text(
+        f"💰 {session.title}: долг {total} ₽\n\n" + "\n".join(lines)
+    )
+
+
+async def paid_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /paid id|@username [сумма]: отметить оплату.
+
+    Без суммы считается, что игрок оплатил весь долг.
+    """
+    message = update.message
+    if message is None:
+        return
+    if not is_admin(update):
+        return
+    if not context.args:
+        await message.reply_text(
+            "Укажите игрока и сумму: /paid @username 500"
+        )
+        return
+    session = admin_session(update)
+    found = session.ledger.find(context.args[0])
+    if found is None:
+        await message.reply_text("⚠️ Игрок не найден.")
+        return
+    key, stats = found
+    if len(context.args) > 1:
+        if not context.args[1].isdigit():
+            await message.reply_text(
+                "Пожалуйста, укажите сумму цифрами (например: 500)"
+            )
+            return
+        amount = int(context.args[1])
+    else:
+        amount = stats.balance
+    if amount <= 0:
+        await message.reply_text("✅ У игрока нет долга.")
+        return
+    stats = await session.record_payment(key, amount)
+    await message.reply_text(
+        f"✅ Оплата {amount} ₽ учтена.\n{player_line(session, key, stats)}"
+    )
+
+
+async def history_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    """Команда /history [N]: последние сыгранные игры"""
+    message = update.message
+    if message is None:
+        return
+    if not is_admin(update):
+        return
+    session = admin_session(update)
+    limit = 10
+    if context.args and context.args[0].isdigit():
+        limit = min(int(context.args[0]), ADMIN_LIST_LIMIT)
+    games = await asyncio.to_thread(
+        session.storage.game_history, session.game_id, limit
+    )
+    if not games:
+        await message.reply_text("📭 Сыгранных игр пока нет.")
+        return
+    lines = [
+        f"{game['date']}: игроков {len(game['players'])}, "
+        f"по {game['amount']} ₽"
+        for game in games
+    ]
+    await message.reply_text(
+        f"📚 {session.title}:\n" + "\n".join(lines)
+    )
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /export [players|history] [csv|json]: выгрузка файлом.
+
+    Выгрузка больше EXPORT_MAX_BYTES не отправляется.
+    """
+    import bulk
+
+    message = update.message
+    if message is None:
+        return
+    if not is_staff(update):
+        return
+    args = [arg.lower() for arg in context.args or []]
+    what = "history" if "history" in args else "players"
+    fmt = "json" if "json" in args else "csv"
+    session = admin_session(update)
+    if what == "players":
+        # Снимок берём в цикле событий, файл пишем в пуле потоков
+        players = session.players.to_list()
+        write = partial(bulk.write_players, players, fmt=fmt)
+    else:
+        write = partial(
+            bulk.write_history, session.storage.iter_history(session.game_id),
+            fmt=fmt
+        )
+    try:
+        document = await asyncio.to_thread(
+            bulk.spool, write, EXPORT_MAX_BYTES
+        )
+    except ValueError as e:
+        await message.reply_text(f"⚠️ Не удалось выгрузить: {e}")
+        return
+    with document:
+        await message.reply_document(
+            document=document,
+            filename=(
+                f"{what}-{session.game_id}-"
+                f"{datetime.date.today().isoformat()}.{fmt}"
+            )
+        )
+
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Файл CSV или JSON с подписью /import [add]: загрузка списка.
+
+    По умолчанию список заменяется целиком, с add - дополняется.
+    """
+    import bulk
+
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    if not is_staff(update):
+        return
+    document = message.document
+    if document is None:
+        return
+    fmt = (document.file_name or "").rsplit(".", 1)[-1].lower()
+    if fmt not in bulk.FORMATS:
+        await message.reply_text(
+            "⚠️ Нужен файл .csv или .json"
+        )
+        return
+    if (document.file_size or 0) > IMPORT_MAX_BYTES:
+        await message.reply_text("⚠️ Файл слишком большой.")
+        return
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    try:
+        players = await asyncio.to_thread(
+            bulk.parse_players, data, fmt, user.id
+        )
+    except ValueError as e:
+        await message.reply_text(f"⚠️ Ошибка в файле: {e}")
+        return
+    replace = "add" not in (message.caption or "").split()[1:]
+    session = admin_session(update)
+    result = await session.apply_batch(players, [], replace=replace)
+    await report_batch(update, session, result)
+
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /batch: пакет изменений, по одному на строку.
+
+    Например:
+        /batch
+        + 123456789 Иван Иванов
+        + Гость Петя
+        - 987654321
+    """
+    import bulk
+
+    message = update.message
+    user = update.effective_user
+    if message is None or message.text is None or user is None:
+        return
+    if not is_staff(update):
+        return
+    first_line, *lines = message.text.split("\n")
+    _, _, rest = first_line.partition(" ")
+    try:
+        adds, removes = bulk.parse_batch(
+            [rest, *lines], user.id
+        )
+    except ValueError as e:
+        await message.reply_text(f"⚠️ {e}")
+        return
+    if not adds and not removes:
+        await message.reply_text(
+            "Укажите изменения по одному на строку: "
+            "'+ Имя', '+ id Имя', '- id' или '- Имя'"
+        )
+        return
+    session = admin_session(update)
+    result = await session.apply_batch(adds, removes)
+    await report_batch(update, session, result)
+
+
+def player_names(players, limit: int = 20) -> str:
+    names = ", ".join(
+        f"{p['first_name']} {p.get('last_name') or ''}".strip()
+        for p in players[:limit]
+    )
+    if len(players) > limit:
+        names += f" и ещё {len(players) - limit}"
+    return names
+
+
+async def report_batch(update: Update, session: GameSession, result):
+    """Ответ администратору и одно объявление в чат игры о пакете"""
+    message = update.message
+    if message is None:
+        return
+    lines = []
+    if result.added:
+        lines.append(f"➕ Записаны: {player_names(result.added)}")
+    if result.removed:
+        lines.append(f"➖ Удалены: {player_names(result.removed)}")
+    if result.waitlisted:
+        lines.append(
+            f"⏳ В листе ожидания: {player_names(result.waitlisted)}"
+        )
+    if result.promoted:
+        lines.append(
+            f"⏫ Из листа ожидания: {player_names(result.promoted)}"
+        )
+    summary = "\n".join(lines)
+    reply = summary or "Список не изменился."
+    if result.skipped:
+        reply += f"\n⚠️ Пропущены: {', '.join(result.skipped)}"
+    await message.reply_text(reply)
+    if not summary:
+        return
+    announce_change(
+        session,
+        f"🛠 Список игроков изменён организатором "
+        f"({len(session.players)}/{session.max_players}):\n{summary}"
+    )
+    for player in result.promoted:
+        notify_promoted(session, player)
 
 
-def is_registered(user_id):
-    return any(p['user_id'] == user_id for p in players)
+def games_keyboard():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(
+            f"🏐 {s.title} ({len(s.players)}/{s.max_players})",
+            callback_data=f"game:{s.game_id}"
+        )]
+        for s in registry
+    ])
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        f"Привет, {update.effective_user.first_name}! "
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    # Ссылка вида t.me/<bot>?start=<game_id> сразу выбирает игру
+    if context.args:
+        registry.select(user.id, context.args[0])
+    await message.reply_text(
+        f"Привет, {user.first_name}! "
         "Добро пожаловать в волейбольный бот 🏐",
         reply_markup=main_keyboard
     )
 
 
+async def choose_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /game: выбор игры, если бот обслуживает несколько"""
+    message = update.message
+    if message is None:
+        return
+    if len(registry) < 2:
+        await message.reply_text("Сейчас проводится только одна игра.")
+        return
+    await message.reply_text(
+        "Выберите игру:", reply_markup=games_keyboard()
+    )
+
+
+async def handle_game_choice(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    """Обработка нажатия inline-кнопки выбора игры"""
+    query = update.callback_query
+    if query is None or query.data is None:
+        return
+    await query.answer()
+
+    game_id = query.data[len("game:"):]
+    session = registry.select(query.from_user.id, game_id)
+    if session is None:
+        await query.edit_message_text("⚠️ Игра не найдена.")
+        return
+    await query.edit_message_text(
+        f"✅ Выбрана игра: {session.title}. "
+        "Кнопки клавиатуры теперь работают с ней."
+    )
+
+
 async def handle_friend_deletion(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
     """Обработка нажатия inline-кнопки удаления друга"""
     query = update.callback_query
+    if query is None or query.data is None:
+        return
     await query.answer()
 
     data = query.data
     if not data.startswith("del_friend:"):
         return
 
-    friend_id = data[len("del_friend:"):]
+    # del_friend:<game_id>:<страница>:<токен>; в старых кнопках вместо
+    # токена полный friend_id, а без игры - игра по умолчанию
+    parts = data[len("del_friend:"):].split(":")
+    friend_id = parts[-1]
+    game_id = parts[0] if len(parts) > 1 else DEFAULT_GAME
+    page = int(parts[1]) if len(parts) > 2 and parts[1].isdigit() else 0
+    session = registry.get(game_id or DEFAULT_GAME)
     user = query.from_user
 
-    friend = next(
-        (p for p in players
-         if p.get('friend_id') == friend_id
-         and p.get('added_by') == user.id),
-        None
-    )
+    if session is None:
+        friend, promoted = None, None
+    else:
+        friend, promoted = await session.withdraw_friend(friend_id, user.id)
 
-    if not friend:
+    if session is None or friend is None:
         await query.edit_message_text(
             "⚠️ Друг не найден или вы не можете его удалить."
         )
         return
 
     friend_name = friend['first_name']
-    players[:] = [p for p in players if p.get('friend_id') != friend_id]
-    save_players()
 
-    await query.edit_message_text(
-        f"✅ Друг {friend_name} удалён из списка."
+    # Остальные друзья остаются на экране, чтобы удалить следующего
+    text = f"✅ Друг {friend_name} удалён из списка."
+    keyboard = friend_keyboard(session, user.id, page)
+    if keyboard is None:
+        await query.edit_message_text(text)
+    else:
+        await query.edit_message_text(text, reply_markup=keyboard)
+    announce_change(
+        session,
+        f"⚠️ Игрок {user.first_name} {user.last_name or ''} "
+        f"удалил друга {friend_name} из списка."
     )
-    await context.bot.send_message(
-        chat_id=VOLLEYBALL_CHAT_ID,
-        text=(
-            f"⚠️ Игрок {user.first_name} {user.last_name or ''} "
-            f"удалил друга {friend_name} из списка."
+    if promoted is not None:
+        announce_promotion(session, promoted)
+
+
+async def handle_friend_menu(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    """Страницы клавиатуры удаления друзей и удаление всех друзей.
+
+    friends_page:<game_id>:<страница>, friends_all:<game_id> (вопрос),
+    friends_all_ok:<game_id> (удаление)
+    """
+    query = update.callback_query
+    if query is None or query.data is None:
+        return
+    await query.answer()
+
+    action, _, rest = query.data.partition(":")
+    game_id, _, page = rest.partition(":")
+    session = registry.get(game_id)
+    user = query.from_user
+    if session is None:
+        await query.edit_message_text("⚠️ Игра не найдена.")
+        return
+
+    if action == "friends_page":
+        keyboard = friend_keyboard(
+            session, user.id, int(page) if page.isdigit() else 0
+        )
+        if keyboard is None:
+            await query.edit_message_text("У вас нет записанных друзей.")
+            return
+        await query.edit_message_text(
+            "Выберите друга, которого хотите удалить:",
+            reply_markup=keyboard
+        )
+        return
+
+    if action == "friends_all":
+        count = session.players.count_friends(user.id)
+        await query.edit_message_text(
+            f"Удалить всех ваших друзей ({count}) из списка?",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    "🗑 Да, удалить всех",
+                    callback_data=f"friends_all_ok:{session.game_id}"
+                ),
+                InlineKeyboardButton(
+                    "Отмена",
+                    callback_data=f"friends_page:{session.game_id}:0"
+                ),
+            ]])
         )
+        return
+
+    if action != "friends_all_ok":
+        return
+    result = await session.withdraw_friends(user.id)
+    if not result.removed:
+        await query.edit_message_text("У вас нет записанных друзей.")
+        return
+    names = player_names(result.removed)
+    await query.edit_message_text(f"✅ Друзья удалены из списка: {names}.")
+    text = (
+        f"⚠️ Игрок {user.first_name} {user.last_name or ''} "
+        f"удалил друзей из списка: {names}."
     )
+    if result.promoted:
+        text += (
+            f"\n⏫ Из листа ожидания: {player_names(result.promoted)}."
+        )
+    announce_change(session, text)
+    for player in result.promoted:
+        notify_promoted(session, player)
 
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global waiting_organizer_response, waiting_payment_amount
+async def on_organizer_game_held(update: Update, session: GameSession):
+    """Ответ организатора о том, состоялась ли игра"""
+    message = update.message
+    user = update.effective_user
+    if message is None or message.text is None or user is None:
+        return
+    user_id = user.id
+    text = message.text.lower()
+    if text in ["да", "yes"]:
+        registry.conversations.begin(
+            user_id, Step.ORGANIZER_AMOUNT, session.game_id, ORGANIZER_TTL
+        )
+        await message.reply_text(
+            "Сколько должен заплатить каждый игрок? "
+            "(укажите сумму в рублях)"
+        )
+    elif text in ["нет", "no"]:
+        registry.conversations.finish(user_id)
+        await session.cancel_game()
+        await message.reply_text("✅ Хорошо, игра не состоялась.")
+    else:
+        await message.reply_text("Пожалуйста, ответьте 'Да' или 'Нет'")
+
 
+async def on_organizer_amount(update: Update, session: GameSession):
+    """Ответ организатора о сумме оплаты"""
+    message = update.message
     user = update.effective_user
-    text = update.message.text
-
-    # Обработка ответа от организатора
-    if str(user.id) == ORGANIZER_CHAT_ID:
-        # Ждем ответ о том, была ли игра
-        if waiting_organizer_response:
-            if text.lower() in ["да", "yes"]:
-                waiting_organizer_response = False
-                waiting_payment_amount = True
-                await update.message.reply_text(
-                    "Сколько должен заплатить каждый игрок? "
-                    "(укажите сумму в рублях)"
-                )
-            elif text.lower() in ["нет", "no"]:
-                waiting_organizer_response = False
-                await update.message.reply_text(
-                    "✅ Хорошо, игра не состоялась."
-                )
-            else:
-                await update.message.reply_text(
-                    "Пожалуйста, ответьте 'Да' или 'Нет'"
-                )
-            return
+    if message is None or message.text is None or user is None:
+        return
+    # Проверяем, что введено число
+    amount_match = re.search(r'\d+', message.text)
+    if not amount_match:
+        await message.reply_text(
+            "Пожалуйста, укажите сумму цифрами (например: 500)"
+        )
+        return
+    amount = amount_match.group()
+    payment_text = (
+        f"🤜🤛 Всем спасибо за игру 🔥 Не забудьте перевести "
+        f"{amount} рублей на номер {PAYMENT_INFORMATION} 💰. "
+    )
+    outbound.announce(session.chat_id, payment_text)
+    registry.conversations.finish(user.id)
+    await session.archive_game(int(amount))
+    await message.reply_text(
+        f"✅ Сообщение об оплате {amount} рублей отправлено в чат!"
+    )
 
-        # Ждем ответ о сумме оплаты
-        if waiting_payment_amount:
-            # Проверяем, что введено число
-            amount_match = re.search(r'\d+', text)
-            if amount_match:
-                amount = amount_match.group()
-                payment_text = (
-                    f"🤜🤛 Всем спасибо за игру 🔥 Не забудьте перевести "
-                    f"{amount} рублей на номер {PAYMENT_INFORMATION} 💰. "
-                )
-                await context.bot.send_message(
-                    chat_id=VOLLEYBALL_CHAT_ID,
-                    text=payment_text
-                )
-                waiting_payment_amount = False
-                await update.message.reply_text(
-                    f"✅ Сообщение об оплате {amount} рублей отправлено в чат!"
-                )
-            else:
-                await update.message.reply_text(
-                    "Пожалуйста, укажите сумму цифрами (например: 500)"
-                )
-            return
 
-    if not user.first_name:
-        await update.message.reply_text(
-            "⚠️ У вас не указано имя в Telegram. "
-            "Пожалуйста, укажите его в настройках."
+async def on_friend_name(update: Update, session: GameSession):
+    """Ввод имени друга после кнопки "Записать друга"."""
+    message = update.message
+    user = update.effective_user
+    if message is None or message.text is None or user is None:
+        return
+    registry.conversations.finish(user.id)
+    friend_name = message.text.strip()
+    if not friend_name:
+        await message.reply_text(
+            "⚠️ Имя не может быть пустым.",
+            reply_markup=main_keyboard
+        )
+        return
+    import uuid
+    friend_id = str(uuid.uuid4())
+    result = await session.sign_up({
+        'user_id': f"friend_{friend_id}",
+        'friend_id': friend_id,
+        'first_name': friend_name,
+        'last_name': '',
+        'username': '',
+        'is_friend': True,
+        'added_by': user.id
+    })
+    if result is Signup.CLOSED:
+        await message.reply_text(
+            "⛔️ Запись уже закрыта.",
+            reply_markup=main_keyboard
+        )
+        return
+    if result is not Signup.OK:
+        await message.reply_text(
+            full_text(session),
+            reply_markup=main_keyboard
         )
         return
+    await message.reply_text(
+        f"✅ Друг {friend_name} записан на волейбол в "
+        f"{session.game_day}!",
+        reply_markup=main_keyboard
+    )
+    announce_change(
+        session,
+        f"👥 Игрок {user.first_name} {user.last_name or ''} "
+        f"записал друга {friend_name} на волейбол."
+    )
 
-    # Обработка ввода имени друга
-    if user.id in pending_add_friend:
-        pending_add_friend.discard(user.id)
-        friend_name = text.strip()
-        if not friend_name:
-            await update.message.reply_text(
-                "⚠️ Имя не может быть пустым.",
-                reply_markup=main_keyboard
-            )
-            return
-        if not REGISTRATION_OPEN:
-            await update.message.reply_text(
-                "⛔️ Запись уже закрыта.",
-                reply_markup=main_keyboard
-            )
-            return
-        if len(players) >= MAX_PLAYERS:
-            await update.message.reply_text(
-                "⛔️ Все места заняты! Максимум 12 человек.",
-                reply_markup=main_keyboard
-            )
-            return
-        import uuid
-        friend_id = str(uuid.uuid4())
-        players.append({
-            'user_id': f"friend_{friend_id}",
-            'friend_id': friend_id,
-            'first_name': friend_name,
-            'last_name': '',
-            'username': '',
-            'is_friend': True,
-            'added_by': user.id
-        })
-        save_players()
-        await update.message.reply_text(
-            f"✅ Друг {friend_name} записан на волейбол в {GAME_DAY}!",
+
+def announce_change(session: GameSession, text: str) -> None:
+    """Объявление в чат игры о записи или отписке.
+
+    В режиме закреплённого списка изменения видны в нём, поэтому отдельные
+    сообщения не отправляются.
+    """
+    if live_roster is None:
+        outbound.announce(session.chat_id, text, group="roster")
+
+
+def notify_promoted(session: GameSession, player) -> None:
+    """Личное сообщение игроку, переведённому из листа ожидания"""
+    # У гостей нет личного чата
+    if isinstance(player['user_id'], int):
+        outbound.announce(
+            player['user_id'],
+            f"🎉 Освободилось место! Вы записаны на волейбол в "
+            f"{session.game_day} ✅",
             reply_markup=main_keyboard
         )
-        await context.bot.send_message(
-            chat_id=VOLLEYBALL_CHAT_ID,
-            text=(
-                f"👥 Игрок {user.first_name} {user.last_name or ''} "
-                f"записал друга {friend_name} на волейбол."
-            )
+
+
+def announce_promotion(session: GameSession, player) -> None:
+    """Сообщает игроку и чату игры, что место из листа ожидания занято"""
+    notify_promoted(session, player)
+    announce_change(
+        session,
+        f"⏫ Игрок {player['first_name']} {player['last_name']} "
+        f"переведён из листа ожидания в список."
+    )
+
+
+def waiting_text(session: GameSession, user_id: int) -> str:
+    position = session.players.waiting_position(user_id)
+    return (
+        f"⏳ Вы в листе ожидания, позиция {position}. "
+        "Когда освободится место, вы будете записаны автоматически."
+    )
+
+
+def full_text(session: GameSession) -> str:
+    return f"⛔️ Все места заняты! Максимум {session.max_players} человек."
+
+
+async def signup(update: Update, session: GameSession):
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    if not session.registration_open:
+        await message.reply_text("⛔️ Запись уже закрыта.")
+        return
+    if session.is_registered(user.id):
+        await message.reply_text("Вы уже записаны ✅")
+    elif session.players.is_waiting(user.id):
+        await message.reply_text(waiting_text(session, user.id))
+    elif session.is_full:
+        registry.conversations.begin(
+            user.id, Step.CONFIRM_SIGNUP, session.game_id
+        )
+        await message.reply_text(
+            f"{full_text(session)}\n"
+            "Встать в лист ожидания? Когда кто-то отпишется, "
+            "вы будете записаны автоматически.",
+            reply_markup=confirm_keyboard
+        )
+    else:
+        registry.conversations.begin(
+            user.id, Step.CONFIRM_SIGNUP, session.game_id
+        )
+        await message.reply_text(
+            f"Волейбол будет в {session.game_day}. Хотите записаться?",
+            reply_markup=confirm_keyboard
         )
+
+
+async def friend_add(update: Update, session: GameSession):
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    if not session.registration_open:
+        await message.reply_text("⛔️ Запись уже закрыта.")
         return
+    if session.is_full:
+        await message.reply_text(full_text(session))
+        return
+    registry.conversations.begin(
+        user.id, Step.FRIEND_NAME, session.game_id
+    )
+    await message.reply_text(
+        "Введите имя друга, которого хотите записать:"
+    )
 
-    if text == "🏃‍♂️‍➡️ Записаться":
-        if not REGISTRATION_OPEN:
-            await update.message.reply_text("⛔️ Запись уже закрыта.")
-            return
-        if is_registered(user.id):
-            await update.message.reply_text("Вы уже записаны ✅")
-        elif len(players) >= MAX_PLAYERS:
-            await update.message.reply_text(
-                "⛔️ Все места заняты! Максимум 12 человек."
-            )
-        else:
-            pending_confirmations.add(user.id)
-            keyboard = ReplyKeyboardMarkup(
-                keyboard=[[KeyboardButton("✅ Да"), KeyboardButton("❌ Нет")]],
-                resize_keyboard=True
-            )
-            await update.message.reply_text(
-                f"Волейбол будет в {GAME_DAY}. Хотите записаться?",
-                reply_markup=keyboard
-            )
 
-    elif text == "👥 Записать друга":
-        if not REGISTRATION_OPEN:
-            await update.message.reply_text("⛔️ Запись уже закрыта.")
-            return
-        if len(players) >= MAX_PLAYERS:
-            await update.message.reply_text(
-                "⛔️ Все места заняты! Максимум 12 человек."
-            )
-            return
-        pending_add_friend.add(user.id)
-        await update.message.reply_text(
-            "Введите имя друга, которого хотите записать:"
+async def friend_menu(update: Update, session: GameSession):
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    keyboard = friend_keyboard(session, user.id)
+    if keyboard is None:
+        await message.reply_text(
+            "У вас нет записанных друзей.",
+            reply_markup=main_keyboard
         )
+        return
+    await message.reply_text(
+        "Выберите друга, которого хотите удалить:",
+        reply_markup=keyboard
+    )
 
-    elif text == "🗑 Удалить друга":
-        my_friends = [
-            p for p in players
-            if p.get('is_friend') and p.get('added_by') == user.id
-        ]
-        if not my_friends:
-            await update.message.reply_text(
-                "У вас нет записанных друзей.",
-                reply_markup=main_keyboard
-            )
-            return
-        buttons = [
-            [InlineKeyboardButton(
-                f"❌ {p['first_name']}",
-                callback_data=f"del_friend:{p['friend_id']}"
-            )]
-            for p in my_friends
-        ]
-        await update.message.reply_text(
-            "Выберите друга, которого хотите удалить:",
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
-
-    elif text == "�🙅 Отписаться":
-        if is_registered(user.id):
-            players[:] = [p for p in players if p['user_id'] != user.id]
-            save_players()
-            await update.message.reply_text("Вы отписались от волейбола.")
-            await context.bot.send_message(
-                chat_id=VOLLEYBALL_CHAT_ID,
-                text=(
-                    f"⚠️ Игрок {user.first_name} "
-                    f"{user.last_name or ''} отписался с игры"
-                )
-            )
-        else:
-            await update.message.reply_text("Вы не были записаны.")
-
-    elif text == "🫂 Список игроков":
-        if players:
-            player_list = "\n".join(
-                [
-                    f"{i+1}. {p['first_name']} {p['last_name']} "
-                    f"(@{p.get('username', '')})".strip()
-                    for i, p in enumerate(players)
-                ]
-            )
-            # Определяем статус в зависимости от условий
-            if not REGISTRATION_OPEN:
-                status_text = "🔒 Закрыта"
-            elif len(players) >= MAX_PLAYERS:
-                status_text = "🚫 Места заняты"
-            else:
-                status_text = "✅ Открыта"
-            status_info = f"Запись: {status_text}\n"
-            player_count = f"({len(players)}/{MAX_PLAYERS})"
-            await update.message.reply_text(
-                f"{status_info}🫂 Список игроков {player_count}:\n{player_list}"
-            )
-        else:
-            # Если список пуст, показываем только статус открыта/закрыта
-            if not REGISTRATION_OPEN:
-                status_text = "🔒 Закрыта"
-            else:
-                status_text = "✅ Открыта"
-            status_info = f"Запись: {status_text}\n"
-            await update.message.reply_text(f"{status_info}Список пуст.")
-
-    elif text == "✅ Да":
-        if user.id in pending_confirmations:
-            if len(players) >= MAX_PLAYERS:
-                await update.message.reply_text(
-                    "⛔️ Все места заняты! Максимум 12 человек.",
-                    reply_markup=main_keyboard
-                )
-            elif is_registered(user.id):
-                await update.message.reply_text(
-                    "Вы уже записаны ✅",
-                    reply_markup=main_keyboard
-                )
-            else:
-                players.append({
-                    'user_id': user.id,
-                    'first_name': user.first_name,
-                    'last_name': user.last_name or "",
-                    'username': user.username or ""
-                })
-                save_players()
-                pending_confirmations.remove(user.id)
-                await update.message.reply_text(
-                    f"Вы записались на волейбол в {GAME_DAY}! ✅",
-                    reply_markup=main_keyboard
-                )
-                if user.id == 303452412:
-                    action = 'приварился 👨‍🏭💥'
-                else:
-                    action = 'записался'
-                await context.bot.send_message(
-                    chat_id=VOLLEYBALL_CHAT_ID,
-                    text=(
-                        f"🏃‍♂️‍➡️ Игрок {user.first_name} "
-                        f"{user.last_name or ''} "
-                        f"{action} на волейбол."
-                    )
-                )
+
+async def withdraw(update: Update, session: GameSession):
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    removed, promoted = await session.withdraw(user.id)
+    if removed is None:
+        await message.reply_text("Вы не были записаны.")
+        return
+    if removed.get('waiting'):
+        await message.reply_text("Вы покинули лист ожидания.")
+        return
+    await message.reply_text("Вы отписались от волейбола.")
+    announce_change(
+        session,
+        f"⚠️ Игрок {user.first_name} "
+        f"{user.last_name or ''} отписался с игры"
+    )
+    if promoted is not None:
+        announce_promotion(session, promoted)
+
+
+def render_roster(session: GameSession) -> str:
+    """Текст списка игроков со статусом записи"""
+    players = session.players
+    if not players:
+        # Если список пуст, показываем только статус открыта/закрыта
+        if not session.registration_open:
+            status_text = "🔒 Закрыта"
         else:
-            await update.message.reply_text(
-                "Сначала выберите '🏃‍♂️‍➡️ Записаться' с клавиатуры.",
-                reply_markup=main_keyboard
-            )
+            status_text = "✅ Открыта"
+        return f"Запись: {status_text}\nСписок пуст."
+    player_list = "\n".join(
+        [
+            f"{i+1}. {p['first_name']} {p['last_name']} "
+            f"(@{p.get('username', '')})".strip()
+            for i, p in enumerate(players)
+        ]
+    )
+    # Определяем статус в зависимости от условий
+    if not session.registration_open:
+        status_text = "🔒 Закрыта"
+    elif session.is_full:
+        status_text = "🚫 Места заняты"
+    else:
+        status_text = "✅ Открыта"
+    player_count = f"({len(players)}/{session.max_players})"
+    text = (
+        f"Запись: {status_text}\n"
+        f"🫂 Список игроков {player_count}:\n{player_list}"
+    )
+    waiting = players.waiting
+    if waiting:
+        waiting_list = "\n".join(
+            f"{i+1}. {p['first_name']} {p['last_name']}".strip()
+            for i, p in enumerate(waiting)
+        )
+        text += f"\n\n⏳ Лист ожидания ({len(waiting)}):\n{waiting_list}"
+    return text
+
+
+def roster_text(session: GameSession) -> str:
+    """Список игроков из кеша; пересобирается только после изменений"""
+    return session.render_cache.get(
+        session.version, "roster", partial(render_roster, session)
+    )
 
-    elif text == "❌ Нет":
-        if user.id in pending_confirmations:
-            pending_confirmations.remove(user.id)
-            await update.message.reply_text(
-                "Запись отменена.",
-                reply_markup=main_keyboard
+
+def render_friend_keyboard(
+    session: GameSession, user_id: int, page: int
+) -> InlineKeyboardMarkup | None:
+    """Страница клавиатуры удаления друзей.
+
+    В callback_data короткий токен друга вместо friend_id, в 64 байта её
+    укладывает friend_callback_data; кнопка "удалить всех" появляется,
+    если друзей больше одного.
+    """
+    players = session.players
+    my_friends = players.friends_of(user_id)
+    if not my_friends:
+        return None
+    game_id = session.game_id
+    tokens = players.friend_tokens(user_id)
+    pages = (len(my_friends) - 1) // FRIENDS_PAGE_SIZE + 1
+    page = min(max(page, 0), pages - 1)
+    start = page * FRIENDS_PAGE_SIZE
+    rows = [
+        [InlineKeyboardButton(
+            f"❌ {p['first_name']}",
+            callback_data=friend_callback_data(
+                game_id, page, tokens[str(p['friend_id'])]
             )
+        )]
+        for p in my_friends[start:start + FRIENDS_PAGE_SIZE]
+    ]
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(
+                "◀️", callback_data=f"friends_page:{game_id}:{page - 1}"
+            ))
+        navigation.append(InlineKeyboardButton(
+            f"{page + 1}/{pages}",
+            callback_data=f"friends_page:{game_id}:{page}"
+        ))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(
+                "▶️", callback_data=f"friends_page:{game_id}:{page + 1}"
+            ))
+        rows.append(navigation)
+    if len(my_friends) > 1:
+        rows.append([InlineKeyboardButton(
+            f"🗑 Удалить всех ({len(my_friends)})",
+            callback_data=f"friends_all:{game_id}"
+        )])
+    return InlineKeyboardMarkup(rows)
+
+
+def friend_keyboard(
+    session: GameSession, user_id: int, page: int = 0
+) -> InlineKeyboardMarkup | None:
+    """Клавиатура удаления друзей из кеша"""
+    return session.render_cache.get(
+        session.version, ("friends", user_id, page),
+        partial(render_friend_keyboard, session, user_id, page)
+    )
+
+
+async def players_list(update: Update, session: GameSession):
+    message = update.message
+    chat = update.effective_chat
+    if message is None or chat is None:
+        return
+    if (live_roster is not None
+            and str(chat.id) == session.chat_id):
+        # В чате игры список уже закреплён
+        return
+    await message.reply_text(roster_text(session))
+
+
+async def confirm(update: Update, session: GameSession):
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    conversation = registry.conversations.at(user.id, Step.CONFIRM_SIGNUP)
+    if conversation is None:
+        await message.reply_text(
+            "Сначала выберите '🏃‍♂️‍➡️ Записаться' с клавиатуры.",
+            reply_markup=main_keyboard
+        )
+        return
+    # Подтверждается запись в ту игру, в которую нажали "Записаться"
+    session = registry.get(conversation.game_id) or session
+    result = await session.sign_up({
+        'user_id': user.id,
+        'first_name': user.first_name,
+        'last_name': user.last_name or "",
+        'username': user.username or ""
+    }, waitlist=True)
+    if result is Signup.CLOSED:
+        registry.conversations.finish(user.id)
+        await message.reply_text(
+            "⛔️ Запись уже закрыта.",
+            reply_markup=main_keyboard
+        )
+    elif result is Signup.WAITLISTED:
+        registry.conversations.finish(user.id)
+        await message.reply_text(
+            waiting_text(session, user.id),
+            reply_markup=main_keyboard
+        )
+    elif result is Signup.DUPLICATE:
+        await message.reply_text(
+            "Вы уже записаны ✅",
+            reply_markup=main_keyboard
+        )
+    else:
+        registry.conversations.finish(user.id)
+        await message.reply_text(
+            f"Вы записались на волейбол в {session.game_day}! ✅",
+            reply_markup=main_keyboard
+        )
+        if user.id == 303452412:
+            action = 'приварился 👨‍🏭💥'
         else:
-            await update.message.reply_text(
-                "Нечего отменять.",
-                reply_markup=main_keyboard
-            )
+            action = 'записался'
+        announce_change(
+            session,
+            f"🏃‍♂️‍➡️ Игрок {user.first_name} "
+            f"{user.last_name or ''} "
+            f"{action} на волейбол."
+        )
+
 
+async def cancel(update: Update, session: GameSession):
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    user_id = user.id
+    if registry.conversations.at(user_id, Step.CONFIRM_SIGNUP):
+        registry.conversations.finish(user_id)
+        await message.reply_text(
+            "Запись отменена.",
+            reply_markup=main_keyboard
+        )
     else:
-        await update.message.reply_text(
+        await message.reply_text(
+            "Нечего отменять.",
+            reply_markup=main_keyboard
+        )
+
+
+# Кнопка клавиатуры -> действие
+BUTTON_ACTIONS = {
+    "🏃‍♂️‍➡️ Записаться": signup,
+    "👥 Записать друга": friend_add,
+    "🗑 Удалить друга": friend_menu,
+    "🙅 Отписаться": withdraw,
+    "🫂 Список игроков": players_list,
+    "✅ Да": confirm,
+    "❌ Нет": cancel,
+}
+
+# Шаг диалога -> обработчик ответа текстом
+STEP_HANDLERS = {
+    Step.ORGANIZER_GAME_HELD: on_organizer_game_held,
+    Step.ORGANIZER_AMOUNT: on_organizer_amount,
+    Step.FRIEND_NAME: on_friend_name,
+}
+
+ORGANIZER_STEPS = (Step.ORGANIZER_GAME_HELD, Step.ORGANIZER_AMOUNT)
+ORGANIZER_ACTIONS = (on_organizer_game_held, on_organizer_amount)
+
+
+def resolve_message(update: Update):
+    """Выбирает действие для текстового сообщения.
+
+    Возвращает (обработчик, игра) или (None, None), если сообщение не
+    кнопка и бот не ждёт от пользователя ответа.
+    """
+    message = update.message
+    chat = update.effective_chat
+    user = update.effective_user
+    if (message is None or message.text is None or chat is None
+            or user is None):
+        return None, None
+    conversation = registry.conversations.get(user.id)
+    # Ответ организатора обрабатывается раньше кнопок
+    if conversation is not None and conversation.step in ORGANIZER_STEPS:
+        session = registry.get(conversation.game_id)
+        if session is not None:
+            return STEP_HANDLERS[conversation.step], session
+    action = BUTTON_ACTIONS.get(message.text)
+    if action is not None:
+        return action, registry.route(chat.id, user.id)
+    if conversation is not None and conversation.step in STEP_HANDLERS:
+        session = registry.get(conversation.game_id)
+        if session is not None:
+            return STEP_HANDLERS[conversation.step], session
+    return None, None
+
+
+class RoutedText(filters.MessageFilter):
+    """Текст, который бот должен обработать.
+
+    Кнопка клавиатуры, ответ на шаге диалога или любой текст в личном
+    чате. Обычные сообщения в групповых чатах до обработчика не доходят.
+    Действие здесь не выбирается: это делает handle_message под
+    блокировкой пользователя, иначе его шаг диалога может смениться
+    между проверкой и обработкой.
+    """
+
+    def filter(self, message) -> bool:
+        if message.text in BUTTON_ACTIONS:
+            return True
+        if message.chat.type == "private":
+            return True
+        user = message.from_user
+        return user is not None and registry.conversations.awaits_text(
+            user.id
+        )
+
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Направляет текстовое сообщение в обработчик кнопки или шага диалога"""
+    message = update.message
+    user = update.effective_user
+    if message is None or user is None:
+        return
+    action, session = resolve_message(update)
+    set_branch(action.__name__ if action is not None else "unknown")
+    if action is None:
+        await message.reply_text(
             "Пожалуйста, выберите действие с клавиатуры."
         )
+        return
+    # Для ответов организатора имя в профиле не нужно
+    if action not in ORGANIZER_ACTIONS and not user.first_name:
+        await message.reply_text(
+            "⚠️ У вас не указано имя в Telegram. "
+            "Пожалуйста, укажите его в настройках."
+        )
+        return
+    await action(update, session)
+
+
+async def ask_organizer(session: GameSession):
+    """Вопрос организатору о том, состоялась ли игра"""
+    await session.finish_game()
+    registry.conversations.begin(
+        int(ORGANIZER_CHAT_ID), Step.ORGANIZER_GAME_HELD, session.game_id,
+        ORGANIZER_TTL
+    )
+    await registry.publish()
+    outbound.announce(
+        ORGANIZER_CHAT_ID, "Была ли игра сегодня?",
+        reply_markup=organizer_keyboard
+    )
+    logger.info(
+        "❓ [%s] Задан вопрос организатору о проведении игры",
+        session.game_id
+    )
+
+
+async def cleanup_players(session: GameSession):
+    """Очистка списка игроков и открытие записи после игры"""
+    logger.info("🧹 [%s] Очищаем список и открываем запись.", session.game_id)
+    async with session.transaction():
+        session.clear_players()
+        if not session.registration_open:
+            session.registration_open = True
+            session.save_state()
+    cleanup_text = (
+        "Волейбол завершён. Список игроков очищен. "
+        f"Запись на следующую игру ({session.game_day}) открыта 🧦"
+    )
+    outbound.announce(session.chat_id, cleanup_text)
+    logger.info("✅ [%s] Список очищен и запись открыта", session.game_id)
+
 
+async def close_registration(session: GameSession):
+    """Закрытие записи"""
+    async with session.transaction():
+        if not session.registration_open:
+            return
+        session.registration_open = False
+        session.save_state()
+    logger.info("🔒 [%s] Закрыта запись.", session.game_id)
+    close_text = (
+        f"🔒 Запись закрыта.\n"
+        f"Записалось игроков: {len(session.players)}/{session.max_players}"
+    )
+    outbound.announce(session.chat_id, close_text)
+    logger.info("📢 Уведомление о закрытии записи поставлено в очередь")
 
-async def reminder_job(app):
-    while True:
-        now = datetime.datetime.now()
-        logger.info(f"⏰ Проверка времени: {now}")
-
-        # Воскресенье 18:00 - вопрос организатору (отключено)
-        # if now.weekday() == 6 and now.hour == 15 and now.minute == 0:
-        #     waiting_organizer_response = True
-        #     keyboard = ReplyKeyboardMarkup(
-        #         keyboard=[[KeyboardButton("Да"), KeyboardButton("Нет")]],
-        #         resize_keyboard=True
-        #     )
-        #     await app.bot.send_message(
-        #         chat_id=ORGANIZER_CHAT_ID,
-        #         text="Была ли игра сегодня?",
-        #         reply_markup=keyboard
-        #     )
-        #     logger.info("❓ Задан вопрос организатору о проведении игры")
-        #     await asyncio.sleep(60)
-
-        # Воскресенье 19:00 - очистка списка и открытие записи (отключено)
-        # if now.weekday() == 6 and now.hour == 19 and now.minute == 0:
-        #     logger.info("🧹 Очищаем список игроков и открываем запись.")
-        #     players.clear()
-        #     save_players()
-        #     if not REGISTRATION_OPEN:
-        #         REGISTRATION_OPEN = True
-        #         save_bot_state()
-        #     cleanup_text = (
-        #         "Волейбол завершён. Список игроков очищен. "
-        #         "Запись на следующее воскресенье открыта 🧦"
-        #     )
-        #     await app.bot.send_message(
-        #         chat_id=VOLLEYBALL_CHAT_ID,
-        #         text=cleanup_text
-        #     )
-        #     logger.info("✅ Список очищен и запись открыта")
-        #     await asyncio.sleep(60)
-
-        # Пятница 11:00 - закрытие записи (отключено)
-        # if now.weekday() == 4 and now.hour == 8 and now.minute == 0:
-        #     if REGISTRATION_OPEN:
-        #         REGISTRATION_OPEN = False
-        #         save_bot_state()
-        #         logger.info("🔒 Закрыта запись.")
-        #         close_text = (
-        #             f"🔒 Запись закрыта.\n"
-        #             f"Записалось игроков: {len(players)}/{MAX_PLAYERS}"
-        #         )
-        #         await app.bot.send_message(
-        #             chat_id=VOLLEYBALL_CHAT_ID,
-        #             text=close_text
-        #         )
-        #         logger.info(
-        #             "📢 Отправлено уведомление о закрытии записи в чат"
-        #         )
-        #     await asyncio.sleep(60)
-
-        await asyncio.sleep(30)
+
+# События, которые можно включить в расписании игры
+SCHEDULED_ACTIONS = {
+    'organizer': ask_organizer,
+    'cleanup': cleanup_players,
+    'close': close_registration,
+}
+
+
+def setup_schedule():
+    """Добавляет в планировщик события из расписания каждой игры"""
+    for session in registry:
+        for event, spec in session.schedule.items():
+            if event not in SCHEDULED_ACTIONS:
+                raise ValueError(
+                    f"Неизвестное событие расписания {event!r} "
+                    f"в игре {session.game_id}"
+                )
+            last_fired = session.last_fired.get(event)
+            scheduler.add(Job(
+                f"{session.game_id}:{event}",
+                WeeklyRule.parse(spec),
+                partial(SCHEDULED_ACTIONS[event], session),
+                last_fired=(
+                    datetime.datetime.fromisoformat(last_fired)
+                    if last_fired else None
+                ),
+                on_fired=partial(mark_fired, session, event)
+            ))
+            logger.info("📅 [%s] %s: %s", session.game_id, event, spec)
+
+
+async def mark_fired(
+    session: GameSession, event: str, moment: datetime.datetime
+):
+    async with session.transaction():
+        session.last_fired[event] = moment.isoformat()
+        session.save_state()
+
+
+async def on_leadership(is_leader: bool):
+    """Расписание выполняет только реплика-лидер"""
+    if not is_leader:
+        await scheduler.stop()
+        return
+    # Прежний лидер мог успеть выполнить задачи: берём время из хранилища
+    await registry.refresh()
+    for job in scheduler.jobs:
+        game_id, event = job.name.split(":", 1)
+        session = registry.get(game_id)
+        last_fired = session.last_fired.get(event) if session else None
+        if last_fired:
+            moment = datetime.datetime.fromisoformat(last_fired)
+            if job.last_fired is None or moment > job.last_fired:
+                job.last_fired = moment
+    scheduler.start()
+
+
+async def refresh_shared(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """До обработчиков: изменения других реплик"""
+    await registry.refresh()
+
+
+async def publish_shared(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """После обработчиков: диалоги, изменённые этим апдейтом"""
+    await registry.publish()
+
+
+async def on_startup(app):
+    # К этому моменту приложение инициализировано (getMe выполнен)
+    startup.mark("connect")
+    outbound.start(app.bot)
+    registry.start()
+    setup_schedule()
+    if leader is not None:
+        leader.start()
+    else:
+        scheduler.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+    if live_roster is not None:
+        live_roster.start(app.bot)
+    startup.mark("services")
+    # В режиме webhook бот готов после запуска HTTP-сервера
+    if BOT_MODE != "webhook":
+        health.mark_ready()
+
+
+async def on_stop(app):
+    """Остановка служб, пока клиент Bot API ещё открыт.
+
+    PTB вызывает её после app.stop() и до app.shutdown(), который
+    закрывает HTTP-клиент: очередь объявлений и последняя правка
+    закреплённого списка ещё успевают уйти.
+    """
+    await health.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    if leader is not None:
+        await leader.stop()
+    await scheduler.stop()
+    # Данные пишем до сетевых ожиданий: их может прервать SIGKILL
+    await registry.flush()
+    if live_roster is not None:
+        await live_roster.stop()
+    await outbound.stop()
+
+
+async def on_shutdown(app):
+    # Дописываем всё, что накопилось в очереди записи
+    await registry.stop()
+    storage.close()
+    if shared_store is not None:
+        shared_store.close()
+    logger.info("💾 Данные сброшены на диск перед остановкой")
 
 
 async def main():
     # Сначала загружаем данные, потом проверяем состояние
-    load_players()
-    load_bot_state()
+    await registry.load_all()
+    startup.mark("load")
 
     # Только для отладки - проверяем, что состояние загрузилось правильно
     logger.info("🔍 Проверяем загруженное состояние...")
-    status = 'открыта' if REGISTRATION_OPEN else 'закрыта'
-    logger.info(f"📝 Текущее состояние записи: {status}")
+    for session in registry:
+        status = 'открыта' if session.registration_open else 'закрыта'
+        logger.info(
+            "📝 [%s] Текущее состояние записи: %s",
+            session.game_id, status
+        )
+
+    app = build_application()
+    startup.mark("build")
+
+    logger.info("🤖 Бот запущен!")
+    if BOT_MODE == "webhook":
+        await run_webhook(app)
+    else:
+        await app.run_polling(timeout=POLLING_TIMEOUT)
+
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
+def build_application(request: BaseRequest | None = None) -> Application:
+    """Создаёт приложение со всеми обработчиками.
+
+    request позволяет подменить HTTP-транспорт к Bot API, например
+    заглушкой в нагрузочном тесте. По умолчанию getUpdates и остальные
+    вызовы идут через разные пулы соединений (см. transport).
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(CONCURRENT_UPDATES or False)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot")
+        builder = builder.base_file_url(
+            f"{BOT_API_URL.rstrip('/')}/file/bot"
+        )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    else:
+        outbound_request, polling_request = create_requests(
+            pool_size=BOT_API_POOL_SIZE,
+            polling_pool_size=POLLING_POOL_SIZE,
+            http_version=BOT_API_HTTP_VERSION,
+            keepalive=BOT_API_KEEPALIVE,
+            connect_timeout=BOT_API_CONNECT_TIMEOUT,
+            read_timeout=BOT_API_READ_TIMEOUT,
+            write_timeout=BOT_API_WRITE_TIMEOUT,
+            pool_timeout=BOT_API_POOL_TIMEOUT
+        )
+        builder = builder.request(outbound_request).get_updates_request(
+            polling_request
+        )
+    app = builder.build()
+    if shared_store is not None:
+        app.add_handler(TypeHandler(Update, refresh_shared), group=-1)
+        app.add_handler(TypeHandler(Update, publish_shared), group=1)
+    app.add_handler(
+        CommandHandler("start", instrumented("start")(start))
+    )
+    app.add_handler(
+        CommandHandler("game", instrumented("game")(choose_game))
+    )
+    app.add_handler(CommandHandler("profile", profile))
+    app.add_handler(CommandHandler("loglevel", loglevel))
+    for command, handler in (
+        ("stats", stats_command),
+        ("debts", debts_command),
+        ("paid", paid_command),
+        ("history", history_command),
+        ("export", export_command),
+        ("batch", batch_command),
+    ):
+        app.add_handler(
+            CommandHandler(command, instrumented(command)(handler))
+        )
+    app.add_handler(
+        MessageHandler(
+            filters.Document.ALL & filters.CaptionRegex(r"^/import\b"),
+            instrumented("import")(import_command)
+        )
+    )
     app.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND & RoutedText(),
+            instrumented("message")(
+                serialized_per_user(handle_message)
+            )
+        )
+    )
+    app.add_handler(
+        CallbackQueryHandler(
+            instrumented("friend_delete")(
+                serialized_per_user(handle_friend_deletion)
+            ),
+            pattern="^del_friend:"
+        )
     )
-    app.add_handler(CallbackQueryHandler(handle_friend_deletion))
-    app.create_task(reminder_job(app))
+    app.add_handler(
+        CallbackQueryHandler(
+            instrumented("friend_menu")(
+                serialized_per_user(handle_friend_menu)
+            ),
+            pattern="^friends_"
+        )
+    )
+    app.add_handler(
+        CallbackQueryHandler(
+            instrumented("game_choice")(handle_game_choice),
+            pattern="^game:"
+        )
+    )
+    return app
 
-    logger.info("🤖 Бот запущен!")
-    await app.run_polling()
+
+async def run_webhook(app):
+    """Запуск бота в режиме webhook на встроенном HTTP-сервере"""
+    from webhook import WebhookServer
+
+    server = WebhookServer(
+        app, WEBHOOK_SECRET, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT
+    )
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    # Тот же порядок, что у run_polling: stop, on_stop, shutdown,
+    # on_shutdown
+    try:
+        async with app:
+            await on_startup(app)
+            await app.start()
+            await server.start()
+            if WEBHOOK_URL:
+                await app.bot.set_webhook(
+                    url=WEBHOOK_URL,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES
+                )
+                logger.info("🔗 Webhook установлен: %s", WEBHOOK_URL)
+            health.mark_ready()
+            try:
+                await stop_event.wait()
+            finally:
+                await server.stop()
+                await app.stop()
+                await on_stop(app)
+    finally:
+        await on_shutdown(app)
 
 
 if __name__ == "__main__":
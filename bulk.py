@@ -0,0 +1,226 @@
+"""Импорт и экспорт списков игроков и истории игр, пакетные изменения.
+
+Форматы: CSV (первая строка - заголовок) и JSON. Экспорт пишет в файловый
+объект построчно, поэтому большой список или длинная история не
+собираются в память строкой. Отправка файла (InputFile из PTB) всё же
+читает его в память целиком, поэтому размер выгрузки ограничен.
+"""
+import io
+import csv
+import json
+import uuid
+import tempfile
+from typing import IO, Any, Callable, Iterable
+
+from roster import Player
+
+# Колонки CSV со списком игроков
+PLAYER_FIELDS = (
+    'user_id', 'first_name', 'last_name', 'username', 'added_by', 'waiting'
+)
+# Колонки CSV с историей: одна строка на игрока в игре
+HISTORY_FIELDS = (
+    'date', 'amount', 'user_id', 'first_name', 'last_name', 'username',
+    'added_by'
+)
+FORMATS = ("csv", "json")
+
+
+def guest(name: str, added_by: int) -> Player:
+    """Игрок без Telegram: хранится так же, как друг игрока"""
+    friend_id = str(uuid.uuid4())
+    return {
+        'user_id': f"friend_{friend_id}",
+        'friend_id': friend_id,
+        'first_name': name,
+        'last_name': '',
+        'username': '',
+        'is_friend': True,
+        'added_by': added_by
+    }
+
+
+def player_from_row(row: dict[str, Any], added_by: int) -> Player:
+    """Игрок из строки CSV или объекта JSON.
+
+    Строка без user_id (или с user_id вида friend_...) считается гостем,
+    которого записал added_by.
+    """
+    name = str(row.get('first_name') or '').strip()
+    if not name:
+        raise ValueError("не указано имя (first_name)")
+    user_id = str(row.get('user_id') or '').strip()
+    owner = str(row.get('added_by') or '').strip()
+    if user_id.lstrip('-').isdigit():
+        player: Player = {
+            'user_id': int(user_id),
+            'first_name': name,
+            'last_name': str(row.get('last_name') or '').strip(),
+            'username': str(row.get('username') or '').strip()
+        }
+    else:
+        player = guest(name, int(owner) if owner.isdigit() else added_by)
+        player['last_name'] = str(row.get('last_name') or '').strip()
+    if str(row.get('waiting') or '').lower() in ("1", "true", "yes", "да"):
+        player['waiting'] = True
+    return player
+
+
+def parse_players(
+    data: bytes, fmt: str, added_by: int
+) -> list[Player]:
+    """Разбирает файл со списком игроков; ошибки - ValueError с номером
+    строки (CSV) или записи (JSON)"""
+    text = data.decode("utf-8-sig")
+    if fmt == "json":
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("JSON должен быть списком игроков")
+        numbered: Iterable[tuple[int, Any]] = enumerate(rows, 1)
+    elif fmt == "csv":
+        numbered = enumerate(csv.DictReader(text.splitlines()), 2)
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    players = []
+    for number, row in numbered:
+        if not isinstance(row, dict):
+            raise ValueError(f"Запись {number}: ожидается объект")
+        try:
+            players.append(player_from_row(row, added_by))
+        except ValueError as e:
+            raise ValueError(f"Запись {number}: {e}") from None
+    return players
+
+
+def parse_batch(
+    lines: Iterable[str], added_by: int
+) -> tuple[list[Player], list[str]]:
+    """Разбирает пакет изменений: по одному на строку.
+
+        + 123456789 Иван Иванов   записать пользователя Telegram
+        + Иван                    записать гостя
+        - 123456789               удалить по user_id
+        - Иван                    удалить по имени
+
+    Возвращает (кого записать, кого удалить).
+    """
+    adds: list[Player] = []
+    removes: list[str] = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        op, _, rest = line.partition(" ")
+        rest = rest.strip()
+        if op not in ("+", "-") or not rest:
+            raise ValueError(
+                f"Строка {number}: ожидается '+ имя' или '- имя'"
+            )
+        if op == "-":
+            removes.append(rest)
+            continue
+        first, _, name = rest.partition(" ")
+        if first.lstrip('-').isdigit():
+            first_name, _, last_name = name.strip().partition(" ")
+            adds.append(player_from_row({
+                'user_id': first, 'first_name': first_name,
+                'last_name': last_name
+            }, added_by))
+        else:
+            adds.append(guest(rest, added_by))
+    return adds, removes
+
+
+def write_players(players: Iterable[Player], out: IO[str], fmt: str) -> None:
+    if fmt == "csv":
+        writer = csv.DictWriter(
+            out, PLAYER_FIELDS, extrasaction="ignore"
+        )
+        writer.writeheader()
+        for player in players:
+            writer.writerow({
+                **player, 'user_id': export_id(player),
+                'waiting': int(bool(player.get('waiting')))
+            })
+        return
+    # JSON-массив по одному игроку на строку
+    out.write("[")
+    for number, player in enumerate(players):
+        out.write(",\n" if number else "\n")
+        out.write(json.dumps(player, ensure_ascii=False))
+    out.write("\n]\n")
+
+
+def write_history(
+    games: Iterable[dict[str, Any]], out: IO[str], fmt: str
+) -> None:
+    """Пишет историю игр: JSON Lines или CSV (строка на игрока в игре)"""
+    if fmt == "json":
+        for game in games:
+            out.write(json.dumps(game, ensure_ascii=False) + "\n")
+        return
+    writer = csv.DictWriter(out, HISTORY_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for game in games:
+        for player in game.get('players', []):
+            writer.writerow({
+                **player, 'user_id': export_id(player),
+                'date': game.get('date'), 'amount': game.get('amount')
+            })
+
+
+class _CappedText(io.TextIOWrapper):
+    """Текстовая обёртка, которая прерывает запись после limit байт"""
+
+    def __init__(self, buffer: IO[bytes], limit: int):
+        super().__init__(buffer, encoding="utf-8", newline="")
+        self.raw_file = buffer
+        self.limit = limit
+
+    def write(self, s: str) -> int:
+        written = super().write(s)
+        # Без учёта ещё не сброшенного буфера обёртки (до нескольких КБ)
+        if self.raw_file.tell() > self.limit:
+            raise ValueError(
+                f"выгрузка больше {self.limit // (1024 * 1024)} МБ"
+            )
+        return written
+
+
+def spool(write: Callable[[IO[str]], None], limit: int) -> IO[bytes]:
+    """Пишет выгрузку во временный файл и возвращает его с начала.
+
+    Файл остаётся в памяти, пока он небольшой, и уходит на диск, когда
+    вырастает. PTB при отправке читает файл в память целиком, поэтому
+    выгрузка больше limit байт прерывается с ValueError. Вызывать из
+    пула потоков.
+    """
+    f = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    text = _CappedText(f, limit)
+    try:
+        write(text)
+        text.flush()
+    except BaseException:
+        text.detach()
+        f.close()
+        raise
+    text.detach()
+    f.seek(0)
+    return f
+
+
+def export_id(player: Player) -> str | int:
+    """user_id для файла: у гостей пусто, при импорте создаётся новый"""
+    return '' if player.get('is_friend') else player['user_id']
+
+
+def find_by_name(players: Iterable[Player], name: str) -> Player | None:
+    """Первый игрок с таким именем (имя и фамилия через пробел)"""
+    name = name.casefold()
+    for player in players:
+        full_name = (
+            f"{player.get('first_name', '')} {player.get('last_name') or ''}"
+        ).strip().casefold()
+        if full_name == name:
+            return player
+    return None
@@ -0,0 +1,169 @@
+import enum
+import time
+import logging
+from typing import Any, Callable, NamedTuple
+
+from metrics import CONVERSATIONS, CONVERSATIONS_EVICTED
+
+logger = logging.getLogger(__name__)
+
+
+class Step(enum.Enum):
+    """Шаг диалога, на котором бот ждёт ответа пользователя"""
+    CONFIRM_SIGNUP = "confirm_signup"
+    FRIEND_NAME = "friend_name"
+    ORGANIZER_GAME_HELD = "organizer_game_held"
+    ORGANIZER_AMOUNT = "organizer_amount"
+
+
+# Шаги, на которых ответом считается произвольный текст, а не кнопка
+TEXT_STEPS = frozenset({
+    Step.FRIEND_NAME, Step.ORGANIZER_GAME_HELD, Step.ORGANIZER_AMOUNT
+})
+
+
+class Conversation(NamedTuple):
+    step: Step
+    game_id: str
+    # Время истечения (time.time()), переживает перезапуск
+    expires: float
+
+
+class Conversations:
+    """Текущий шаг диалога каждого пользователя.
+
+    У пользователя не больше одного незавершённого диалога: новый шаг
+    заменяет предыдущий. Диалог живёт ttl секунд: просроченные записи
+    не возвращаются и удаляются при чтении или периодической очистке
+    (sweep). Записей не больше limit: при переполнении удаляется диалог,
+    начатый раньше всех.
+
+    on_change вызывается после каждого изменения, через него состояние
+    сохраняется в хранилище. Кроме того, запоминается, чьи диалоги
+    изменились (take_changes): реплики с общим хранилищем записывают
+    только их.
+    """
+
+    def __init__(self, ttl: float = 600, limit: int = 10000):
+        self.ttl = ttl
+        self.limit = limit
+        # Порядок словаря - порядок начала диалогов
+        self._by_user: dict[int, Conversation] = {}
+        self._changed_users: set[int] = set()
+        self.on_change: Callable[[], None] | None = None
+        CONVERSATIONS.set_function(self.__len__)
+
+    def __len__(self) -> int:
+        return len(self._by_user)
+
+    def _changed(self, *user_ids: int) -> None:
+        self._changed_users.update(user_ids)
+        if self.on_change is not None:
+            self.on_change()
+
+    def get(self, user_id: int) -> Conversation | None:
+        conversation = self._by_user.get(user_id)
+        if conversation is None:
+            return None
+        if conversation.expires <= time.time():
+            del self._by_user[user_id]
+            self._changed(user_id)
+            return None
+        return conversation
+
+    def begin(
+        self,
+        user_id: int,
+        step: Step,
+        game_id: str,
+        ttl: float | None = None
+    ) -> None:
+        # Переставляем в конец, чтобы вытеснялись самые старые диалоги
+        self._by_user.pop(user_id, None)
+        while len(self._by_user) >= self.limit:
+            oldest = next(iter(self._by_user))
+            del self._by_user[oldest]
+            self._changed_users.add(oldest)
+            CONVERSATIONS_EVICTED.inc()
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._by_user[user_id] = Conversation(step, game_id, expires)
+        self._changed(user_id)
+
+    def at(self, user_id: int, step: Step) -> Conversation | None:
+        """Диалог пользователя, если он находится на шаге step"""
+        conversation = self.get(user_id)
+        if conversation is not None and conversation.step is step:
+            return conversation
+        return None
+
+    def finish(self, user_id: int, step: Step | None = None) -> None:
+        """Завершает диалог (только если он на шаге step, если указан)"""
+        if step is not None and not self.at(user_id, step):
+            return
+        if self._by_user.pop(user_id, None) is not None:
+            self._changed(user_id)
+
+    def awaits_text(self, user_id: int) -> bool:
+        conversation = self.get(user_id)
+        return conversation is not None and conversation.step in TEXT_STEPS
+
+    def sweep(self) -> int:
+        """Удаляет просроченные диалоги; возвращает их количество"""
+        now = time.time()
+        expired = [
+            user_id for user_id, conversation in self._by_user.items()
+            if conversation.expires <= now
+        ]
+        for user_id in expired:
+            del self._by_user[user_id]
+        if expired:
+            self._changed(*expired)
+        return len(expired)
+
+    def to_list(self) -> list[dict[str, Any]]:
+        return [
+            self._entry(user_id, c) for user_id, c in self._by_user.items()
+        ]
+
+    def take_changes(self) -> dict[int, dict[str, Any] | None]:
+        """Изменённые с прошлого вызова диалоги; None - диалог удалён"""
+        changes = {}
+        for user_id in self._changed_users:
+            conversation = self._by_user.get(user_id)
+            changes[user_id] = (
+                None if conversation is None
+                else self._entry(user_id, conversation)
+            )
+        self._changed_users.clear()
+        return changes
+
+    def requeue(self, changes: dict[int, Any]) -> None:
+        """Возвращает изменения, которые не удалось записать"""
+        self._changed_users.update(changes)
+
+    @staticmethod
+    def _entry(user_id: int, c: Conversation) -> dict[str, Any]:
+        return {
+            'user_id': user_id, 'game': c.game_id, 'step': c.step.value,
+            'expires': c.expires
+        }
+
+    def load(self, entries: list[dict[str, Any]]) -> None:
+        """Восстанавливает диалоги после перезапуска, кроме просроченных"""
+        now = time.time()
+        self._by_user.clear()
+        self._changed_users.clear()
+        for entry in entries:
+            try:
+                conversation = Conversation(
+                    Step(entry['step']), entry['game'],
+                    float(entry['expires'])
+                )
+                user_id = int(entry['user_id'])
+            except (KeyError, ValueError, TypeError) as e:
+                logger.warning("⚠️ Пропущен повреждённый диалог: %s", e)
+                continue
+            if conversation.expires > now:
+                self._by_user[user_id] = conversation
+        while len(self._by_user) > self.limit:
+            del self._by_user[next(iter(self._by_user))]
@@ -0,0 +1,135 @@
+"""Замеры запуска и проверка готовности бота.
+
+Модуль также запускается как скрипт для healthcheck в docker compose:
+
+    python health.py [путь к файлу] [максимальный возраст, с]
+
+Код выхода 0, если бот отметил готовность и обновлял файл не дольше
+заданного времени назад.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Начало отсчёта запуска: бот импортирует этот модуль раньше библиотек
+IMPORTED_AT = time.perf_counter()
+
+DEFAULT_HEALTH_FILE = "/tmp/bot.ready"
+# Файл обновляется раз в HEARTBEAT секунд; если цикл событий завис,
+# файл устаревает и healthcheck начинает падать
+HEARTBEAT = 15
+MAX_AGE = 60
+
+
+class StartupTimer:
+    """Длительность этапов запуска"""
+
+    def __init__(self, started: float = IMPORTED_AT):
+        self.started = started
+        self._last = self.started
+        self.phases: dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        """Завершает этап phase, начатый в конце предыдущего этапа"""
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self._last, 3)
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return round(self._last - self.started, 3)
+
+    def summary(self) -> str:
+        phases = " ".join(f"{k}={v}" for k, v in self.phases.items())
+        return f"total={self.total} {phases}"
+
+
+class Health:
+    """Готовность бота: флаг для HTTP-проверки и файл для docker.
+
+    Файл создаётся, когда бот готов принимать апдейты, и периодически
+    перезаписывается; при остановке удаляется. Запись и удаление файла
+    выполняются в пуле потоков, а не в цикле событий.
+    """
+
+    def __init__(self, timer: StartupTimer, path: str = DEFAULT_HEALTH_FILE):
+        self.timer = timer
+        self.path = path
+        self.ready = False
+        self._task: asyncio.Task | None = None
+        # Запись, начатая до stop, не должна вернуть удалённый файл
+        self._file_lock = threading.Lock()
+
+    def is_ready(self) -> bool:
+        return self.ready
+
+    def mark_ready(self) -> None:
+        if self.ready:
+            return
+        self.timer.mark("ready")
+        self.ready = True
+        logger.info("🚀 Бот готов: %s", self.timer.summary())
+        if self.path:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        self.ready = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.path:
+            await asyncio.to_thread(self._remove)
+
+    def _remove(self) -> None:
+        with self._file_lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _write(self) -> None:
+        data = {
+            'pid': os.getpid(),
+            'updated': time.time(),
+            'startup': {'total': self.timer.total, **self.timer.phases},
+        }
+        with self._file_lock:
+            if not self.ready:
+                return
+            try:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error("❌ Не удалось записать файл готовности: %s", e)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.to_thread(self._write)
+            await asyncio.sleep(HEARTBEAT)
+
+
+def check(path: str = DEFAULT_HEALTH_FILE, max_age: float = MAX_AGE) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path) <= max_age
+    except OSError:
+        return False
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.getenv(
+        "HEALTH_FILE", DEFAULT_HEALTH_FILE
+    )
+    max_age = float(sys.argv[2]) if len(sys.argv) > 2 else MAX_AGE
+    sys.exit(0 if check(path, max_age) else 1)
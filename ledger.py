@@ -0,0 +1,151 @@
+from typing import Any, Iterable
+
+from roster import Player
+
+
+class PlayerStats:
+    """Накопленные итоги игрока по одной игре"""
+
+    __slots__ = ("name", "username", "played", "first_game", "charged", "paid")
+
+    def __init__(
+        self,
+        name: str = "",
+        username: str = "",
+        played: int = 0,
+        first_game: int = 0,
+        charged: int = 0,
+        paid: int = 0
+    ):
+        self.name = name
+        self.username = username
+        self.played = played
+        # Номер первой сыгранной игры; 0 - ещё не играл (например, только
+        # записывал друзей)
+        self.first_game = first_game
+        self.charged = charged
+        self.paid = paid
+
+    @property
+    def balance(self) -> int:
+        """Сколько игрок должен; отрицательное значение - переплата"""
+        return self.charged - self.paid
+
+    def to_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Ledger:
+    """Итоги по игрокам: сколько игр сыграно, посещаемость и долг.
+
+    Итоги обновляются по одной сыгранной игре или одной оплате, поэтому
+    ответ на запрос администратора не требует перечитывать историю игр.
+    Оплата за друга начисляется тому, кто его записал (added_by).
+    """
+
+    def __init__(self):
+        self.games_held = 0
+        self._stats: dict[str, PlayerStats] = {}
+        self._by_username: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+    def get(self, user_id: int | str) -> PlayerStats | None:
+        return self._stats.get(str(user_id))
+
+    def find(self, query: str) -> tuple[str, PlayerStats] | None:
+        """Игрок по user_id или @username"""
+        query = query.strip()
+        if query.startswith("@"):
+            key = self._by_username.get(query[1:].lower())
+        else:
+            key = query
+        if key is None or key not in self._stats:
+            return None
+        return key, self._stats[key]
+
+    def attendance(self, stats: PlayerStats) -> float:
+        """Доля игр, сыгранных с момента первой игры игрока"""
+        if not stats.first_game:
+            return 0.0
+        return stats.played / (self.games_held - stats.first_game + 1)
+
+    def record_game(self, players: Iterable[Player], amount: int) -> None:
+        """Учитывает сыгранную игру; amount - сумма с каждого игрока"""
+        self.games_held += 1
+        for player in players:
+            if player.get('is_friend'):
+                owner = player.get('added_by')
+                if owner is not None:
+                    self._entry(str(owner)).charged += amount
+                continue
+            stats = self._entry(str(player['user_id']))
+            stats.name = (
+                f"{player.get('first_name', '')} "
+                f"{player.get('last_name') or ''}"
+            ).strip()
+            self._set_username(
+                str(player['user_id']), stats,
+                str(player.get('username') or '')
+            )
+            if not stats.first_game:
+                stats.first_game = self.games_held
+            stats.played += 1
+            stats.charged += amount
+
+    def record_payment(self, user_id: int | str, amount: int) -> PlayerStats:
+        stats = self._entry(str(user_id))
+        stats.paid += amount
+        return stats
+
+    def debtors(self) -> list[tuple[str, PlayerStats]]:
+        """Игроки с долгом, начиная с самого большого"""
+        return sorted(
+            ((key, s) for key, s in self._stats.items() if s.balance > 0),
+            key=lambda item: item[1].balance, reverse=True
+        )
+
+    def top(self) -> list[tuple[str, PlayerStats]]:
+        """Игроки по числу сыгранных игр"""
+        return sorted(
+            self._stats.items(), key=lambda item: item[1].played,
+            reverse=True
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'games_held': self.games_held,
+            'players': {
+                key: stats.to_dict() for key, stats in self._stats.items()
+            }
+        }
+
+    def load(self, data: dict[str, Any] | None) -> None:
+        self.games_held = 0
+        self._stats.clear()
+        self._by_username.clear()
+        if not data:
+            return
+        self.games_held = data.get('games_held', 0)
+        for key, values in data.get('players', {}).items():
+            stats = PlayerStats(**values)
+            self._stats[key] = stats
+            if stats.username:
+                self._by_username[stats.username.lower()] = key
+
+    def _entry(self, key: str) -> PlayerStats:
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = PlayerStats()
+        return stats
+
+    def _set_username(
+        self, key: str, stats: PlayerStats, username: str
+    ) -> None:
+        if stats.username == username:
+            return
+        self._by_username.pop(stats.username.lower(), None)
+        stats.username = username
+        if username:
+            self._by_username[username.lower()] = key
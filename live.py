@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from typing import Any, Callable
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from logs import background_task
+from metrics import LIVE_UPDATES, TELEGRAM_SECONDS
+from session import GameSession
+
+logger = logging.getLogger(__name__)
+
+
+class LiveRoster:
+    """Закреплённое сообщение со списком игроков, обновляемое на месте.
+
+    Каждое изменение игры только помечает её как изменённую. Через delay
+    секунд после первого изменения сообщение редактируется один раз, так
+    что десять записей подряд дают одно редактирование. Если текст не
+    изменился, запрос не отправляется. Если сообщения ещё нет или его
+    удалили, бот публикует новое и закрепляет его.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[GameSession], str],
+        delay: float = 3.0
+    ):
+        self.render = render
+        self.delay = delay
+        self.bot: Any = None
+        self._texts: dict[str, str] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._sessions: dict[str, GameSession] = {}
+
+    def watch(self, session: GameSession) -> None:
+        self._sessions[session.game_id] = session
+        session.listeners.append(self.touch)
+
+    def start(self, bot: Any) -> None:
+        self.bot = bot
+        # Сверяем закреплённые сообщения с текущими списками
+        for session in self._sessions.values():
+            self.touch(session)
+
+    async def stop(self) -> None:
+        """Отменяет ожидание и сразу применяет отложенные обновления"""
+        pending = [
+            self._sessions[game] for game, task in self._tasks.items()
+            if not task.done()
+        ]
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        for session in pending:
+            await self.update(session)
+
+    def touch(self, session: GameSession) -> None:
+        """Помечает игру изменённой; обновление выполнится с задержкой"""
+        if self.bot is None:
+            return
+        task = self._tasks.get(session.game_id)
+        if task is None or task.done():
+            self._tasks[session.game_id] = background_task(
+                self._debounced(session)
+            )
+
+    async def _debounced(self, session: GameSession) -> None:
+        await asyncio.sleep(self.delay)
+        # Изменения во время отправки запустят следующее обновление
+        del self._tasks[session.game_id]
+        await self.update(session)
+
+    async def update(self, session: GameSession) -> None:
+        text = self.render(session)
+        if self._texts.get(session.game_id) == text:
+            LIVE_UPDATES.inc(result="unchanged")
+            return
+        try:
+            if session.live_message_id is not None:
+                await self._edit(session, text)
+            else:
+                await self._post(session, text)
+            self._texts[session.game_id] = text
+        except RetryAfter as e:
+            LIVE_UPDATES.inc(result="failed")
+            logger.warning(
+                "⏳ [%s] Flood limit при обновлении списка, повтор через %s с",
+                session.game_id, e.retry_after
+            )
+            await asyncio.sleep(e.retry_after)
+            self.touch(session)
+        except TelegramError as e:
+            LIVE_UPDATES.inc(result="failed")
+            logger.error(
+                "❌ [%s] Не удалось обновить закреплённый список: %s",
+                session.game_id, e
+            )
+
+    async def _edit(self, session: GameSession, text: str) -> None:
+        try:
+            with TELEGRAM_SECONDS.time(method="editMessageText"):
+                await self.bot.edit_message_text(
+                    text, chat_id=session.chat_id,
+                    message_id=session.live_message_id
+                )
+            LIVE_UPDATES.inc(result="edited")
+        except BadRequest as e:
+            message = str(e).lower()
+            if "not modified" in message:
+                # Текст уже такой (например, после перезапуска)
+                LIVE_UPDATES.inc(result="unchanged")
+            elif "not found" in message or "can't be edited" in message:
+                logger.warning(
+                    "⚠️ [%s] Закреплённый список удалён, публикуем заново",
+                    session.game_id
+                )
+                await self._post(session, text)
+            else:
+                raise
+
+    async def _post(self, session: GameSession, text: str) -> None:
+        with TELEGRAM_SECONDS.time(method="sendMessage"):
+            message = await self.bot.send_message(
+                chat_id=session.chat_id, text=text
+            )
+        LIVE_UPDATES.inc(result="posted")
+        async with session.transaction():
+            session.live_message_id = message.message_id
+            session.save_state()
+        try:
+            with TELEGRAM_SECONDS.time(method="pinChatMessage"):
+                await self.bot.pin_chat_message(
+                    chat_id=session.chat_id,
+                    message_id=message.message_id,
+                    disable_notification=True
+                )
+        except TelegramError as e:
+            # Без прав администратора бот не может закреплять сообщения
+            logger.warning(
+                "⚠️ [%s] Не удалось закрепить список: %s",
+                session.game_id, e
+            )
+        logger.info(
+            "📌 [%s] Опубликован список игроков (сообщение %s)",
+            session.game_id, message.message_id
+        )
@@ -0,0 +1,233 @@
+"""Логирование без записи в поток вывода из цикла событий.
+
+В вызывающем потоке запись проходит фильтры, получает контекст апдейта
+и готовый текст сообщения и кладётся в очередь (QueueHandler); строку
+формата, трассировку исключения и запись в поток делает отдельный поток
+(QueueListener). К записи добавляются
+идентификаторы обрабатываемого апдейта, одинаковые сообщения
+ограничиваются по частоте, уровни можно менять по модулям на ходу.
+"""
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import datetime
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import IO, Any, Coroutine
+
+# Апдейт, который обрабатывается в текущей задаче: update_id, chat_id,
+# user_id, handler
+update_context: contextvars.ContextVar[dict[str, Any] | None] = (
+    contextvars.ContextVar("update_context", default=None)
+)
+
+# Поля записи, которые попадают в JSON, если заданы (через контекст
+# апдейта или extra=)
+EXTRA_FIELDS = (
+    "update_id", "chat_id", "user_id", "handler", "duration_ms", "suppressed"
+)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def background_task(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """Фоновая задача без контекста апдейта.
+
+    Задача копирует контекст того, кто её создал. Очередь отправки,
+    созданная в обработчике, иначе подписывала бы все свои записи в лог
+    первым апдейтом.
+    """
+    context = contextvars.copy_context()
+    context.run(update_context.set, None)
+    return asyncio.create_task(coro, context=context)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи идентификаторы текущего апдейта"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = update_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше burst сообщений с одним шаблоном за window секунд.
+
+    Шаблон - строка до подстановки аргументов, поэтому ограничиваются
+    повторяющиеся сообщения вида logger.debug("... %d", n), а не
+    уникальные. Ошибки проходят всегда. Сколько сообщений пропущено,
+    сообщается в следующем прошедшем (поле suppressed).
+    """
+
+    # Сколько шаблонов помнить до очистки устаревших
+    MAX_KEYS = 1000
+
+    def __init__(self, burst: int = 20, window: float = 10.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        # Шаблон -> [начало окна, сообщений в окне, пропущено]
+        self._windows: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                if len(self._windows) >= self.MAX_KEYS:
+                    self._prune(now)
+                self._windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+    def _prune(self, now: float) -> None:
+        for key in [
+            key for key, window in self._windows.items()
+            if now - window[0] >= self.window
+        ]:
+            del self._windows[key]
+
+
+class LazyQueueHandler(QueueHandler):
+    """Кладёт в очередь запись с уже подставленными аргументами.
+
+    В вызывающем потоке остаются фильтры (частота, контекст апдейта из
+    contextvars), копирование записи, подстановка аргументов в сообщение
+    и постановка в очередь. Стандартный QueueHandler вдобавок форматирует
+    запись целиком (время, трассировку исключения); здесь это, как и
+    запись в поток вывода, делает поток записи.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат плюс контекст апдейта"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        context = " ".join(
+            f"{key}={getattr(record, key)}" for key in EXTRA_FIELDS
+            if key != "suppressed" and hasattr(record, key)
+        )
+        if context:
+            text += f" [{context}]"
+        if hasattr(record, "suppressed"):
+            text += f" (пропущено похожих: {record.suppressed})"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in EXTRA_FIELDS:
+            if hasattr(record, key):
+                data[key] = getattr(record, key)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def set_levels(spec: str) -> dict[str, str]:
+    """Уровни по модулям: "storage=DEBUG,httpx=WARNING".
+
+    Возвращает применённые уровни; ValueError, если уровень неизвестен.
+    """
+    applied = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Неизвестный уровень логирования: {level!r}")
+        name = name.strip()
+        if name == "root":
+            name = ""
+        logging.getLogger(name or None).setLevel(level)
+        applied[name or "root"] = level
+    return applied
+
+
+def configured_levels() -> dict[str, str]:
+    """Модули с явно заданным уровнем"""
+    levels = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "text",
+    levels: str = "",
+    burst: int = 20,
+    window: float = 10.0,
+    stream: IO[str] | None = None
+) -> QueueListener:
+    """Настраивает корневой логгер на запись через очередь"""
+    if fmt not in ("text", "json"):
+        raise ValueError(
+            f"Неизвестный LOG_FORMAT: {fmt!r} (ожидается text или json)"
+        )
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    # Сначала ограничение частоты: пропущенные записи дальше не идут
+    handler.addFilter(RateLimitFilter(burst, window))
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    set_levels(levels)
+    listener = QueueListener(log_queue, output)
+    listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: QueueListener) -> None:
+    # Слушатель могли уже остановить явно; повторный stop падает
+    if getattr(listener, "_thread", None) is not None:
+        listener.stop()
@@ -0,0 +1,427 @@
+import io
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from importlib.util import find_spec
+from typing import Any, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0
+)
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    )
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Базовая метрика с именованными метками.
+
+    Значения обновляются и из цикла событий, и из пула потоков (запись
+    на диск), поэтому изменения защищены блокировкой.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Метрика {self.name} ожидает метки {self.labelnames}, "
+                f"получены {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{labels} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией при каждом чтении"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+        self._functions: dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        self._functions[self._key(labels)] = function
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        with self._lock:
+            values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.error(
+                    "❌ Ошибка вычисления метрики %s: %s", self.name, e
+                )
+        for key, value in values.items():
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Метки -> (счётчики корзин, сумма, количество)
+        self._values: dict[LabelValues, list[Any]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][i] += 1
+                    break
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        data = self._values.get(self._key(labels))
+        return data[2] if data else 0
+
+    def total(self, **labels) -> float:
+        """Сумма наблюдений"""
+        data = self._values.get(self._key(labels))
+        return data[1] if data else 0.0
+
+    def labelsets(self) -> list[dict[str, str]]:
+        """Наборы меток, для которых есть наблюдения"""
+        with self._lock:
+            keys = list(self._values)
+        return [dict(zip(self.labelnames, key)) for key in keys]
+
+    def samples(self) -> Iterator[tuple[str, str, float]]:
+        with self._lock:
+            items = [
+                (key, list(data[0]), data[1], data[2])
+                for key, data in self._values.items()
+            ]
+        names = self.labelnames + ("le",)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield (
+                    "_bucket",
+                    _format_labels(names, key + (_format_value(bound),)),
+                    cumulative
+                )
+            labels = _format_labels(self.labelnames, key)
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, help: str, labels: tuple[str, ...] = ()
+    ) -> Counter:
+        metric = Counter(name, help, labels)
+        self.register(metric)
+        return metric
+
+    def gauge(
+        self, name: str, help: str, labels: tuple[str, ...] = ()
+    ) -> Gauge:
+        metric = Gauge(name, help, labels)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels: tuple[str, ...] = (), **kwargs
+    ) -> Histogram:
+        metric = Histogram(name, help, labels, **kwargs)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Обработчики апдейтов
+UPDATES = REGISTRY.counter(
+    "bot_updates_total", "Обработанные апдейты", ("handler", "branch")
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Время обработки апдейта", ("handler", "branch")
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",)
+)
+
+# Запись на диск
+STORAGE_WRITE_SECONDS = REGISTRY.histogram(
+    "bot_storage_write_seconds", "Время записи в хранилище",
+    ("game", "kind")
+)
+STORAGE_WRITE_ERRORS = REGISTRY.counter(
+    "bot_storage_write_errors_total", "Ошибки записи в хранилище", ("game",)
+)
+STORAGE_PENDING = REGISTRY.gauge(
+    "bot_storage_pending", "Изменения, ожидающие записи", ("game",)
+)
+
+# Исходящие сообщения
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "bot_telegram_request_seconds", "Время вызова Bot API", ("method",)
+)
+TELEGRAM_RESULTS = REGISTRY.counter(
+    "bot_outbound_messages_total", "Исходящие сообщения по результату",
+    ("result",)
+)
+BOT_API_SECONDS = REGISTRY.histogram(
+    "bot_api_http_seconds", "Время HTTP-запроса к Bot API",
+    ("endpoint", "pool")
+)
+BOT_API_ERRORS = REGISTRY.counter(
+    "bot_api_http_errors_total", "Ошибки HTTP-запросов к Bot API",
+    ("endpoint", "pool", "error")
+)
+OUTBOUND_PENDING = REGISTRY.gauge(
+    "bot_outbound_pending", "Сообщения в очереди отправки"
+)
+
+# Планировщик
+SCHEDULER_LAG = REGISTRY.histogram(
+    "bot_scheduler_lag_seconds", "Опоздание срабатывания задачи", ("job",),
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 3600.0)
+)
+
+# Диалоги
+CONVERSATIONS = REGISTRY.gauge(
+    "bot_conversations", "Незавершённые диалоги пользователей"
+)
+CONVERSATIONS_EVICTED = REGISTRY.counter(
+    "bot_conversations_evicted_total", "Диалоги, вытесненные из-за лимита"
+)
+
+# Закреплённый список игроков
+LIVE_UPDATES = REGISTRY.counter(
+    "bot_live_roster_updates_total",
+    "Обновления закреплённого списка по результату", ("result",)
+)
+
+
+class Profiler:
+    """Профилировщик, включаемый командой администратора.
+
+    Использует yappi (учитывает время ожидания в корутинах), если он
+    установлен, иначе cProfile. Модули профилировщиков импортируются
+    только при включении.
+    """
+
+    def __init__(self):
+        self._profile: Any = None
+        self._yappi: Any = None
+        self.started: float | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None
+
+    @property
+    def engine(self) -> str:
+        return "yappi" if find_spec("yappi") is not None else "cProfile"
+
+    def start(self) -> None:
+        if self.running:
+            return
+        if self.engine == "yappi":
+            import yappi
+            self._yappi = yappi
+            yappi.clear_stats()
+            yappi.set_clock_type("wall")
+            yappi.start()
+        else:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self.started = time.monotonic()
+        logger.info("🔬 Профилирование (%s) включено", self.engine)
+
+    def stop(self, limit: int = 40) -> str:
+        """Останавливает профилирование и возвращает отчёт"""
+        if not self.running:
+            return ""
+        duration = time.monotonic() - (self.started or 0)
+        self.started = None
+        out = io.StringIO()
+        if self._yappi is not None:
+            out.write(f"yappi, {duration:.1f} с\n\n")
+            self._yappi.stop()
+            stats = self._yappi.get_func_stats()
+            stats.sort("ttot")
+            stats.print_all(out=out)
+            self._yappi.clear_stats()
+            self._yappi = None
+        else:
+            import pstats
+            out.write(f"cProfile, {duration:.1f} с\n\n")
+            self._profile.disable()
+            pstats.Stats(self._profile, stream=out).sort_stats(
+                "cumulative"
+            ).print_stats(limit)
+            self._profile = None
+        logger.info("🔬 Профилирование остановлено через %.1f с", duration)
+        return out.getvalue()
+
+
+class MetricsServer:
+    """HTTP-сервер с эндпоинтом /metrics для Prometheus.
+
+    Также отвечает на /healthz (процесс жив) и /readyz (бот готов
+    принимать апдейты, по функции ready).
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        host: str = "127.0.0.1",
+        port: int = 9100,
+        ready: Callable[[], bool] | None = None
+    ):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.ready = ready
+        self._runner: Any = None
+
+    async def handle_metrics(self, request):
+        from aiohttp import web
+        return web.Response(
+            text=self.registry.render(),
+            content_type="text/plain",
+            charset="utf-8",
+            headers={"Cache-Control": "no-store"}
+        )
+
+    async def handle_health(self, request):
+        from aiohttp import web
+        return web.Response(text="ok")
+
+    async def handle_ready(self, request):
+        from aiohttp import web
+        if self.ready is not None and not self.ready():
+            return web.Response(status=503, text="starting")
+        return web.Response(text="ready")
+
+    async def start(self) -> None:
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_get("/readyz", self.handle_ready)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(
+            "📈 Метрики доступны на %s:%s/metrics", self.host, self.port
+        )
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
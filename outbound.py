@@ -0,0 +1,208 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from logs import background_task
+from metrics import OUTBOUND_PENDING, TELEGRAM_RESULTS, TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _take(self) -> float:
+        """Берёт токен; возвращает, сколько секунд подождать, если нет"""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (delay := self._take()) > 0:
+            await asyncio.sleep(delay)
+
+
+class Announcement:
+    __slots__ = ("chat_id", "text", "group", "kwargs", "created")
+
+    def __init__(
+        self,
+        chat_id: int | str,
+        text: str,
+        group: str | None,
+        kwargs: dict[str, Any]
+    ):
+        self.chat_id = chat_id
+        self.text = text
+        self.group = group
+        self.kwargs = kwargs
+        self.created = time.monotonic()
+
+
+class OutboundDispatcher:
+    """Очередь исходящих сообщений бота.
+
+    Обработчики ставят сообщения в очередь и сразу возвращаются. Для каждого
+    чата работает свой обработчик очереди, сообщения отправляются с учётом
+    общего лимита и лимита на чат. При RetryAfter и сетевых ошибках отправка
+    повторяется с нарастающей задержкой.
+
+    Сообщения одной группы (group), поставленные в течение merge_window
+    секунд, склеиваются в одно сообщение.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 25.0,
+        chat_rate: float = 20 / 60,
+        chat_burst: float = 5,
+        merge_window: float = 0.0,
+        max_retries: int = 5
+    ):
+        self.bot: Any = None
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.merge_window = merge_window
+        self.max_retries = max_retries
+        self._queues: dict[str, deque[Announcement]] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self.sent = 0
+        self.failed = 0
+        OUTBOUND_PENDING.set_function(lambda: self.pending)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def start(self, bot: Any) -> None:
+        self.bot = bot
+
+    def announce(
+        self,
+        chat_id: int | str,
+        text: str,
+        group: str | None = None,
+        **kwargs
+    ) -> None:
+        """Ставит сообщение в очередь отправки"""
+        key = str(chat_id)
+        queue = self._queues.setdefault(key, deque())
+        queue.append(Announcement(chat_id, text, group, kwargs))
+        if key not in self._workers:
+            self._workers[key] = background_task(self._drain(key))
+
+    async def flush(self, timeout: float = 10.0) -> None:
+        """Ждёт отправки всего, что уже в очереди"""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            logger.warning(
+                "⚠️ Не отправлено сообщений при остановке: %s",
+                self.pending
+            )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        await self.flush(timeout)
+        for task in list(self._workers.values()):
+            task.cancel()
+
+    async def _drain(self, key: str) -> None:
+        queue = self._queues[key]
+        bucket = self._buckets.setdefault(
+            key, TokenBucket(self.chat_rate, self.chat_burst)
+        )
+        try:
+            while queue:
+                item = queue.popleft()
+                if item.group is not None and self.merge_window > 0:
+                    item = await self._merge(queue, item)
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                await self._send(item)
+        finally:
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
+
+    async def _merge(
+        self, queue: deque[Announcement], item: Announcement
+    ) -> Announcement:
+        wait = item.created + self.merge_window - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        same = [
+            other for other in queue
+            if other.group == item.group and not other.kwargs
+        ]
+        if not same or item.kwargs:
+            return item
+        for other in same:
+            queue.remove(other)
+        texts = [item.text] + [other.text for other in same]
+        return Announcement(item.chat_id, "\n".join(texts), None, {})
+
+    async def _send(self, item: Announcement) -> None:
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with TELEGRAM_SECONDS.time(method="sendMessage"):
+                    await self.bot.send_message(
+                        chat_id=item.chat_id, text=item.text, **item.kwargs
+                    )
+                self.sent += 1
+                TELEGRAM_RESULTS.inc(result="sent")
+                return
+            except RetryAfter as e:
+                TELEGRAM_RESULTS.inc(result="retry_after")
+                logger.warning(
+                    "⏳ Flood limit в чате %s, ждём %s с",
+                    item.chat_id, e.retry_after
+                )
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                # BadRequest наследует NetworkError, но повторять его незачем
+                TELEGRAM_RESULTS.inc(result="bad_request")
+                logger.error(
+                    "❌ Сообщение в %s не отправлено: %s",
+                    item.chat_id, e
+                )
+                break
+            except NetworkError as e:
+                TELEGRAM_RESULTS.inc(result="network_error")
+                logger.warning(
+                    "⚠️ Сетевая ошибка при отправке в %s (попытка %d): %s",
+                    item.chat_id, attempt, e
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+            except Exception as e:
+                TELEGRAM_RESULTS.inc(result="error")
+                logger.error(
+                    "❌ Сообщение в %s не отправлено: %s",
+                    item.chat_id, e
+                )
+                break
+        self.failed += 1
+        TELEGRAM_RESULTS.inc(result="failed")
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from typing import Callable
+
+from roster import Player
+from storage import StorageBackend, Record
+from metrics import (
+    STORAGE_PENDING, STORAGE_WRITE_ERRORS, STORAGE_WRITE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+WriteJob = Callable[[], None]
+
+
+class PersistenceWriter:
+    """Фоновая запись состояния на диск.
+
+    Обработчики только ставят изменения в очередь и сразу возвращаются.
+    Фоновая задача собирает изменения за короткое окно (delay), так что
+    десять записей подряд превращаются в одну запись на диск, и выполняет
+    её в пуле потоков, не блокируя цикл событий.
+    """
+
+    def __init__(
+        self,
+        storage: StorageBackend,
+        game: str,
+        snapshot: Callable[[], list[Player]],
+        delay: float = 0.2
+    ):
+        self.storage = storage
+        self.game = game
+        self.delay = delay
+        self._snapshot = snapshot
+        self._records: list[Record] = []
+        self._compact_requested = False
+        self._jobs: dict[str, WriteJob] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        # Вызывается в пуле потоков после каждой записи (общее состояние
+        # реплик увеличивает по нему ревизию игры)
+        self.on_written: Callable[[], None] | None = None
+        STORAGE_PENDING.set_function(self.pending_count, game=game)
+
+    def pending_count(self) -> int:
+        return (
+            len(self._records) + len(self._jobs)
+            + int(self._compact_requested)
+        )
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._records or self._compact_requested or self._jobs)
+
+    def append(self, record: Record) -> None:
+        """Ставит в очередь запись журнала игроков"""
+        self._records.append(record)
+        self._wakeup.set()
+
+    def compact(self) -> None:
+        """Запрашивает полную перезапись снимка игроков"""
+        # Снимок включает все накопленные изменения
+        self._records.clear()
+        self._compact_requested = True
+        self._wakeup.set()
+
+    def submit(self, key: str, job: WriteJob) -> None:
+        """Ставит в очередь запись файла.
+
+        Более поздняя задача с тем же ключом заменяет ещё не выполненную,
+        поэтому job должна записывать уже подготовленные данные целиком.
+        """
+        self._jobs[key] = job
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Немедленно записывает всё накопленное"""
+        async with self._lock:
+            if not self.has_pending:
+                return
+            records, self._records = self._records, []
+            jobs, self._jobs = self._jobs, {}
+            snapshot = None
+            if (self._compact_requested or self.storage.should_compact(
+                    self.game, len(records))):
+                # Снимок берём в цикле событий, пока список не меняется
+                snapshot = self._snapshot()
+                records = []
+            self._compact_requested = False
+
+            loop = asyncio.get_running_loop()
+            try:
+                failed = await loop.run_in_executor(
+                    None, self._write, snapshot, records, jobs
+                )
+            except Exception as e:
+                logger.error("❌ Ошибка записи списка игроков: %s", e)
+                STORAGE_WRITE_ERRORS.inc(game=self.game)
+                self._requeue(snapshot, records, jobs)
+                self._wakeup.set()
+                return
+            for key in failed:
+                self._jobs.setdefault(key, jobs[key])
+            if failed:
+                self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.delay)
+            self._wakeup.clear()
+            # Остановка не должна прерывать запись на середине
+            await asyncio.shield(self.flush())
+
+    def _write(
+        self,
+        snapshot: list[Player] | None,
+        records: list[Record],
+        jobs: dict[str, WriteJob]
+    ) -> list[str]:
+        if snapshot is not None:
+            with STORAGE_WRITE_SECONDS.time(game=self.game, kind="snapshot"):
+                self.storage.write_players(self.game, snapshot)
+            logger.debug("💾 Игроки сохранены. Всего: %d", len(snapshot))
+        if records:
+            with STORAGE_WRITE_SECONDS.time(game=self.game, kind="changes"):
+                self.storage.append_changes(self.game, records)
+        failed = []
+        for key, job in jobs.items():
+            try:
+                with STORAGE_WRITE_SECONDS.time(game=self.game, kind=key):
+                    job()
+            except Exception as e:
+                logger.error("❌ Ошибка сохранения '%s': %s", key, e)
+                STORAGE_WRITE_ERRORS.inc(game=self.game)
+                failed.append(key)
+        if self.on_written is not None:
+            try:
+                self.on_written()
+            except Exception as e:
+                logger.error("❌ Ошибка после записи '%s': %s", self.game, e)
+        return failed
+
+    def _requeue(
+        self,
+        snapshot: list[Player] | None,
+        records: list[Record],
+        jobs: dict[str, WriteJob]
+    ) -> None:
+        if snapshot is not None:
+            self._compact_requested = True
+        else:
+            self._records[:0] = records
+        for key, job in jobs.items():
+            self._jobs.setdefault(key, job)
@@ -0,0 +1,32 @@
+from typing import Any, Callable, Hashable
+
+
+class RenderCache:
+    """Кеш готовых текстов и клавиатур игры.
+
+    Значения действительны, пока не изменилась версия (список игроков,
+    статус записи, лимит). При смене версии кеш очищается целиком, поэтому
+    повторный показ списка стоит одного поиска в словаре.
+    """
+
+    def __init__(self):
+        self._version: Hashable = None
+        self._items: dict[Hashable, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(
+        self, version: Hashable, key: Hashable, build: Callable[[], Any]
+    ) -> Any:
+        if version != self._version:
+            self._items.clear()
+            self._version = version
+        if key in self._items:
+            self.hits += 1
+            return self._items[key]
+        self.misses += 1
+        value = self._items[key] = build()
+        return value
@@ -0,0 +1,251 @@
+import logging
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+Player = dict[str, str | int | bool]
+PlayerKey = str | int
+
+# Длина короткого идентификатора друга для callback_data (friend_id -
+# UUID из 36 символов, а на всю callback_data Telegram даёт 64 байта)
+FRIEND_TOKEN_LENGTH = 8
+# На сколько символов удлинять токен, если с другим другом того же
+# пользователя совпадает начало
+FRIEND_TOKEN_STEP = 2
+# Предел длины callback_data в Telegram, байт
+CALLBACK_DATA_LIMIT = 64
+
+
+class Roster:
+    """Список игроков с индексами по user_id, friend_id и added_by.
+
+    Порядок записи сохраняется, все поиски и удаления выполняются за O(1).
+    version увеличивается при каждом изменении, по нему сбрасываются кеши.
+    Друзья (в том числе в листе ожидания) индексируются по friend_id и
+    по пригласившему. Для кнопок у друга есть короткий токен - начало
+    friend_id без дефисов, единственное среди друзей того же
+    пользователя. Токен ищется только среди них и только если подходит
+    ровно одному, поэтому кнопка, выданная до перезапуска или до записи
+    нового друга, удаляет того же друга или никого.
+
+    Игроки с флагом waiting хранятся отдельно, в листе ожидания (FIFO), и
+    не считаются записанными. В снимке (to_list) они идут после основного
+    списка, поэтому хранилище сохраняет их теми же записями, что и игроков.
+    """
+
+    __slots__ = (
+        "_players", "_by_friend", "_by_owner", "_waiting", "version"
+    )
+
+    def __init__(self, players: Iterable[Player] = ()):
+        self._players: dict[PlayerKey, Player] = {}
+        self._by_friend: dict[str, PlayerKey] = {}
+        # Упорядоченное множество friend_id для каждого пригласившего
+        self._by_owner: dict[int, dict[str, None]] = {}
+        self._waiting: dict[PlayerKey, Player] = {}
+        self.version = 0
+        for player in players:
+            self.add(player)
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def __iter__(self) -> Iterator[Player]:
+        return iter(self._players.values())
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._players
+
+    @property
+    def waiting(self) -> list[Player]:
+        """Лист ожидания в порядке очереди"""
+        return list(self._waiting.values())
+
+    def is_waiting(self, user_id: PlayerKey) -> bool:
+        return user_id in self._waiting
+
+    def waiting_position(self, user_id: PlayerKey) -> int | None:
+        """Позиция в листе ожидания, начиная с 1"""
+        if user_id not in self._waiting:
+            return None
+        for position, key in enumerate(self._waiting, 1):
+            if key == user_id:
+                return position
+        return None
+
+    def get(self, user_id: PlayerKey) -> Player | None:
+        return self._players.get(user_id)
+
+    def get_friend(self, friend_id: str) -> Player | None:
+        key = self._by_friend.get(friend_id)
+        if key is None:
+            return None
+        return self._players.get(key) or self._waiting.get(key)
+
+    def find_friend(self, owner_id: int, token: str) -> Player | None:
+        """Друг owner_id по токену или по полному friend_id.
+
+        Токен должен быть началом friend_id ровно одного из друзей
+        owner_id, иначе друг не найден.
+        """
+        owned = self._by_owner.get(owner_id, {})
+        if token in owned:
+            return self.get_friend(token)
+        if len(token) < FRIEND_TOKEN_LENGTH:
+            return None
+        matches = [
+            friend_id for friend_id in owned
+            if friend_id.replace("-", "").startswith(token)
+        ]
+        if len(matches) != 1:
+            return None
+        return self.get_friend(matches[0])
+
+    def friend_tokens(self, owner_id: int) -> dict[str, str]:
+        """Кратчайшие различимые токены друзей owner_id по friend_id.
+
+        Токен удлиняется на FRIEND_TOKEN_STEP символов, пока совпадает с
+        началом friend_id другого друга. Совпадения ищутся только у
+        соседей в отсортированном порядке, поэтому O(n log n).
+        """
+        digits = sorted(
+            (friend_id.replace("-", ""), friend_id)
+            for friend_id in self._by_owner.get(owner_id, {})
+        )
+        tokens = {}
+        for i, (hex_id, friend_id) in enumerate(digits):
+            common = 0
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(digits):
+                    common = max(common, _common_prefix(hex_id, digits[j][0]))
+            length = FRIEND_TOKEN_LENGTH
+            while length <= common:
+                length += FRIEND_TOKEN_STEP
+            tokens[friend_id] = hex_id[:length]
+        return tokens
+
+    def friends_of(self, owner_id: int) -> list[Player]:
+        """Друзья, записанные пользователем, в порядке записи"""
+        friends = []
+        for friend_id in self._by_owner.get(owner_id, {}):
+            key = self._by_friend[friend_id]
+            friends.append(self._players.get(key) or self._waiting[key])
+        return friends
+
+    def count_friends(self, owner_id: int) -> int:
+        return len(self._by_owner.get(owner_id, {}))
+
+    def add(self, player: Player) -> None:
+        key = player['user_id']
+        if key in self._players or key in self._waiting:
+            raise ValueError(f"Игрок {key} уже в списке")
+        if player.get('waiting'):
+            self._waiting[key] = player
+        else:
+            self._players[key] = player
+        self.version += 1
+        friend_id = player.get('friend_id')
+        if isinstance(friend_id, str):
+            self._index_friend(key, friend_id, player.get('added_by'))
+
+    def remove(self, user_id: PlayerKey) -> Player | None:
+        """Удаляет игрока из списка или из листа ожидания"""
+        player = self._players.pop(user_id, None)
+        if player is None:
+            player = self._waiting.pop(user_id, None)
+            if player is None:
+                return None
+        self.version += 1
+        friend_id = player.get('friend_id')
+        if isinstance(friend_id, str):
+            self._unindex_friend(friend_id, player.get('added_by'))
+        return player
+
+    def _index_friend(
+        self, key: PlayerKey, friend_id: str, owner: object
+    ) -> None:
+        self._by_friend[friend_id] = key
+        if isinstance(owner, int):
+            self._by_owner.setdefault(owner, {})[friend_id] = None
+
+    def _unindex_friend(self, friend_id: str, owner: object) -> None:
+        self._by_friend.pop(friend_id, None)
+        if isinstance(owner, int) and owner in self._by_owner:
+            owned = self._by_owner[owner]
+            owned.pop(friend_id, None)
+            if not owned:
+                del self._by_owner[owner]
+
+    def remove_friend(self, friend_id: str) -> Player | None:
+        key = self._by_friend.get(friend_id)
+        return None if key is None else self.remove(key)
+
+    def first_waiting(self) -> Player | None:
+        """Первый в листе ожидания, за O(1)"""
+        return next(iter(self._waiting.values()), None)
+
+    def clear(self) -> None:
+        self._players.clear()
+        self._by_friend.clear()
+        self._by_owner.clear()
+        self._waiting.clear()
+        self.version += 1
+
+    def replace(self, players: Iterable[Player]) -> None:
+        """Заменяет содержимое списка (например, при загрузке из файла).
+
+        Повторы user_id пропускаются: из-за одной испорченной записи не
+        должен пропасть весь список.
+        """
+        self.clear()
+        for player in players:
+            key = player['user_id']
+            if key in self._players or key in self._waiting:
+                logger.warning("⚠️ Пропущен повтор игрока %s", key)
+                continue
+            self.add(player)
+
+    def adopt(self, other: "Roster") -> None:
+        """Забирает содержимое other целиком, за O(1).
+
+        Список загружается в отдельный Roster в пуле потоков и
+        подставляется уже в цикле событий, так что читатели никогда не
+        видят его наполовину заполненным.
+        """
+        self._players = other._players
+        self._by_friend = other._by_friend
+        self._by_owner = other._by_owner
+        self._waiting = other._waiting
+        self.version = max(self.version, other.version) + 1
+
+    def to_list(self) -> list[Player]:
+        """Снимок для хранилища: игроки, затем лист ожидания"""
+        return list(self._players.values()) + list(self._waiting.values())
+
+
+def _common_prefix(a: str, b: str) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+def friend_callback_data(game_id: str, page: int, token: str) -> str:
+    """callback_data кнопки удаления друга: del_friend:<игра>:<стр>:<токен>.
+
+    Игра не длиннее 16 символов (GAME_ID_RE), токен UUID - не длиннее 32,
+    так что предел превышает только номер страницы от 100: тогда он
+    опускается (после удаления откроется первая страница). Если не
+    помещается и без него, токен укорачивается: неоднозначный токен
+    find_friend не найдёт, чужой друг не удалится.
+    """
+    data = f"del_friend:{game_id}:{page}:{token}"
+    if len(data.encode()) <= CALLBACK_DATA_LIMIT:
+        return data
+    prefix = f"del_friend:{game_id}:"
+    room = CALLBACK_DATA_LIMIT - len(prefix.encode())
+    if room < FRIEND_TOKEN_LENGTH:
+        raise ValueError(f"слишком длинный идентификатор игры: {game_id}")
+    return prefix + token[:room]
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import datetime
+from typing import Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from tzlocal import get_localzone
+
+from metrics import SCHEDULER_LAG
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6
+}
+
+# Пропущенное событие (бот был выключен) выполняется при старте,
+# если с момента срабатывания прошло не больше этого времени
+MISFIRE_GRACE = datetime.timedelta(hours=1)
+
+# Сон не дольше часа, чтобы переход часов или остановка контейнера
+# не сдвигали срабатывание
+MAX_SLEEP = 3600
+
+
+def get_timezone(name: str = "") -> datetime.tzinfo:
+    """Часовой пояс по имени IANA или локальный пояс системы"""
+    if name:
+        return ZoneInfo(name)
+    return get_localzone()
+
+
+class WeeklyRule:
+    """Правило вида "fri 08:00", "sat,sun 10:30" или "daily 09:00"."""
+
+    __slots__ = ("days", "time")
+
+    def __init__(self, days: frozenset[int], time: datetime.time):
+        self.days = days
+        self.time = time
+
+    @classmethod
+    def parse(cls, spec: str) -> "WeeklyRule":
+        try:
+            days_part, time_part = spec.split()
+            hour, minute = (int(x) for x in time_part.split(":"))
+            time = datetime.time(hour, minute)
+            if days_part in ("daily", "*"):
+                days = frozenset(range(7))
+            else:
+                days = frozenset(
+                    WEEKDAYS[d.strip().lower()[:3]]
+                    for d in days_part.split(",")
+                )
+        except (ValueError, KeyError):
+            raise ValueError(
+                f"Некорректное расписание {spec!r}, "
+                f"ожидается например 'fri 08:00'"
+            )
+        return cls(days, time)
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """Ближайшее срабатывание строго после moment"""
+        for offset in range(8):
+            day = moment.date() + datetime.timedelta(days=offset)
+            candidate = datetime.datetime.combine(
+                day, self.time, tzinfo=moment.tzinfo
+            )
+            if candidate.weekday() in self.days and candidate > moment:
+                return candidate
+        raise AssertionError("unreachable")
+
+    def previous(self, moment: datetime.datetime) -> datetime.datetime:
+        """Последнее срабатывание не позже moment"""
+        for offset in range(8):
+            day = moment.date() - datetime.timedelta(days=offset)
+            candidate = datetime.datetime.combine(
+                day, self.time, tzinfo=moment.tzinfo
+            )
+            if candidate.weekday() in self.days and candidate <= moment:
+                return candidate
+        raise AssertionError("unreachable")
+
+
+class Job:
+    """Задача расписания.
+
+    on_fired вызывается до выполнения action, чтобы время срабатывания
+    было сохранено и перезапуск посреди задачи не выполнил её повторно.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rule: WeeklyRule,
+        action: Callable[[], Awaitable[None]],
+        last_fired: datetime.datetime | None = None,
+        on_fired: Callable[[datetime.datetime], Awaitable[None]] | None = None
+    ):
+        self.name = name
+        self.rule = rule
+        self.action = action
+        self.last_fired = last_fired
+        self.on_fired = on_fired
+
+    def next_due(self, now: datetime.datetime) -> datetime.datetime:
+        if self.last_fired is not None:
+            previous = self.rule.previous(now)
+            if (previous > self.last_fired
+                    and now - previous <= MISFIRE_GRACE):
+                return previous
+            return self.rule.next_after(max(now, self.last_fired))
+        return self.rule.next_after(now)
+
+
+class Scheduler:
+    """Планировщик, который спит ровно до ближайшей задачи."""
+
+    def __init__(self, tz: datetime.tzinfo):
+        self.tz = tz
+        self._jobs: dict[str, Job] = {}
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def jobs(self) -> list[Job]:
+        return list(self._jobs.values())
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(self.tz)
+
+    def add(self, job: Job) -> None:
+        if job.name in self._jobs:
+            raise ValueError(f"Задача {job.name} уже добавлена")
+        self._jobs[job.name] = job
+        self._changed.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._changed.clear()
+            now = self.now()
+            upcoming = [
+                (job.next_due(now), job) for job in self._jobs.values()
+            ]
+            if not upcoming:
+                await self._changed.wait()
+                continue
+            due, job = min(upcoming, key=lambda item: item[0])
+            delay = (due - now).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait(), timeout=min(delay, MAX_SLEEP)
+                    )
+                    # Добавили задачу: пересчитываем ближайшую
+                    continue
+                except asyncio.TimeoutError:
+                    if self.now() < due:
+                        continue
+            await self._fire(job, due)
+
+    async def _fire(self, job: Job, due: datetime.datetime) -> None:
+        job.last_fired = due
+        if job.on_fired is not None:
+            # Не сохранённое время не должно останавливать планировщик:
+            # задача выполняется, в памяти срабатывание уже отмечено
+            try:
+                await job.on_fired(due)
+            except Exception as e:
+                logger.error(
+                    "❌ Не удалось сохранить срабатывание %s: %s", job.name, e
+                )
+        lag = (self.now() - due).total_seconds()
+        SCHEDULER_LAG.observe(lag, job=job.name)
+        logger.info("⏰ Задача %s (опоздание %.1f с)", job.name, lag)
+        try:
+            await job.action()
+        except Exception as e:
+            logger.error("❌ Ошибка задачи %s: %s", job.name, e)
@@ -0,0 +1,768 @@
+import re
+import enum
+import json
+import asyncio
+import logging
+import datetime
+from contextlib import asynccontextmanager
+from typing import (
+    TYPE_CHECKING, Any, AsyncIterator, Callable, Hashable, Iterator,
+    NamedTuple
+)
+
+from roster import Roster, Player
+from storage import StorageBackend, Record, DEFAULT_GAME
+from persistence import PersistenceWriter
+from conversation import Conversations
+from render import RenderCache
+from ledger import Ledger, PlayerStats
+
+# bulk и shared нужны только командам администратора и репликам с общим
+# хранилищем, поэтому импортируются при первом использовании
+if TYPE_CHECKING:
+    from shared import SharedStore
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор игры попадает в callback_data и имена файлов
+GAME_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,16}$")
+
+
+class Signup(enum.Enum):
+    """Результат попытки записи"""
+    OK = "ok"
+    CLOSED = "closed"
+    FULL = "full"
+    DUPLICATE = "duplicate"
+    WAITLISTED = "waitlisted"
+
+
+class Withdrawal(NamedTuple):
+    """Результат отписки: кто удалён и кто переведён из листа ожидания"""
+    removed: Player | None
+    promoted: Player | None
+
+
+class Batch(NamedTuple):
+    """Итог пакетного изменения списка"""
+    added: list[Player]
+    waitlisted: list[Player]
+    removed: list[Player]
+    # Не найдены для удаления или уже в списке
+    skipped: list[str]
+    promoted: list[Player]
+
+
+class KeyedLocks:
+    """Набор asyncio-блокировок по ключу; неиспользуемые удаляются"""
+
+    def __init__(self):
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._holders: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._holders[key] = self._holders.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
+
+
+class GameSession:
+    """Одна игра в одном чате: свой список, лимит, день и состояние записи"""
+
+    def __init__(
+        self,
+        game_id: str,
+        chat_id: str,
+        storage: StorageBackend,
+        max_players: int = 12,
+        game_day: str = "воскресенье",
+        title: str = "",
+        schedule: dict[str, str] | None = None
+    ):
+        if not GAME_ID_RE.match(game_id):
+            raise ValueError(f"Некорректный идентификатор игры: {game_id!r}")
+        self.game_id = game_id
+        self.chat_id = chat_id
+        self.storage = storage
+        self.max_players = max_players
+        self.game_day = game_day
+        self.title = title or game_day
+        # Событие -> правило расписания, например {"close": "fri 08:00"}
+        self.schedule = schedule or {}
+        # Событие -> время последнего срабатывания (ISO)
+        self.last_fired: dict[str, str] = {}
+        self.players = Roster()
+        self.registration_open = True
+        self.render_cache = RenderCache()
+        # Закреплённое сообщение со списком в чате игры (режим live roster)
+        self.live_message_id: int | None = None
+        # Итоги по игрокам: сыгранные игры, посещаемость, долги
+        self.ledger = Ledger()
+        # Состав сыгранной игры до ответа организатора: к этому времени
+        # список могут уже очистить для записи на следующую игру
+        self.finished_players: list[Player] | None = None
+        # Вызываются после каждого изменения списка или состояния игры
+        self.listeners: list[Callable[["GameSession"], None]] = []
+        self.persistence = PersistenceWriter(
+            storage, game_id, self.players.to_list
+        )
+        # Все проверки и изменения списка выполняются под этой блокировкой
+        self.lock = asyncio.Lock()
+        # Общее состояние реплик (см. share); revision - ревизия игры,
+        # которую отражает копия в памяти
+        self.shared: "SharedStore | None" = None
+        self.replica = ""
+        self.revision = 0
+
+    @property
+    def revision_key(self) -> str:
+        return f"game:{self.game_id}"
+
+    def share(self, store: "SharedStore", replica: str) -> None:
+        """Включает работу нескольких реплик с общим хранилищем"""
+        self.shared = store
+        self.replica = replica
+        self.persistence.on_written = self._published
+
+    def _published(self) -> None:
+        """После записи в пуле потоков: сообщает ревизию другим репликам"""
+        assert self.shared is not None
+        revision = self.shared.bump(self.revision_key)
+        # Если между записями вклинилась другая реплика, ревизия
+        # останется старой и игра будет перечитана
+        if revision == self.revision + 1:
+            self.revision = revision
+
+    @property
+    def version(self) -> tuple[int, bool, int]:
+        """Всё, от чего зависят тексты и клавиатуры игры"""
+        return (self.players.version, self.registration_open, self.max_players)
+
+    @property
+    def is_full(self) -> bool:
+        return len(self.players) >= self.max_players
+
+    def is_registered(self, user_id: int) -> bool:
+        return user_id in self.players
+
+    async def load_async(self) -> None:
+        """Читает игроков и состояние параллельно в пуле потоков"""
+        async with self.lock:
+            await self._load()
+
+    async def _load(self) -> None:
+        """Загрузка игры; вызывается под self.lock.
+
+        Игроки читаются в пуле потоков в новый Roster, а подставляются и
+        состояние применяется уже в цикле событий. Обработчики читают
+        список без блокировки, поэтому живой список из потока не
+        меняется.
+        """
+        if self.shared is not None:
+            # Ревизию читаем до данных: запись между ними лишь вызовет
+            # повторное чтение
+            self.revision = await asyncio.to_thread(
+                self.shared.revision, self.revision_key
+            )
+        players, state = await asyncio.gather(
+            asyncio.to_thread(self.load_players),
+            asyncio.to_thread(self.read_state)
+        )
+        if players is not None:
+            self.players.adopt(players)
+        self.apply_state(state)
+
+    def load_players(self) -> Roster | None:
+        """Читает игроков в новый Roster; None при ошибке, и тогда
+        текущий список остаётся как есть"""
+        players = Roster()
+        try:
+            self.storage.load_players(self.game_id, players)
+        except Exception as e:
+            logger.error(
+                "❌ [%s] Ошибка загрузки игроков: %s", self.game_id, e
+            )
+            return None
+        logger.info(
+            "✅ [%s] Игроки загружены. Всего: %d", self.game_id, len(players)
+        )
+        return players
+
+    def read_state(self) -> dict[str, Any] | None:
+        try:
+            return self.storage.load_state(self.game_id)
+        except Exception as e:
+            logger.error(
+                "❌ [%s] Ошибка загрузки состояния: %s, "
+                "устанавливаем по умолчанию", self.game_id, e
+            )
+            return None
+
+    def apply_state(self, state: dict[str, Any] | None) -> None:
+        """Применяет загруженное состояние игры (открыта/закрыта запись)"""
+        if state is None:
+            self.registration_open = True
+            logger.info(
+                "📭 [%s] Состояние не найдено, устанавливаем по умолчанию",
+                self.game_id
+            )
+            # Сохраняем состояние по умолчанию
+            self.save_state()
+            return
+        self.registration_open = state.get('registration_open', True)
+        self.last_fired = state.get('last_fired', {})
+        self.live_message_id = state.get('live_message_id')
+        self.finished_players = state.get('finished_players')
+        self.ledger.load(state.get('ledger'))
+        status = 'открыта' if self.registration_open else 'закрыта'
+        logger.info(
+            "✅ [%s] Состояние загружено. Запись: %s",
+            self.game_id, status
+        )
+
+    def state(self) -> dict[str, Any]:
+        return {
+            'registration_open': self.registration_open,
+            'last_fired': dict(self.last_fired),
+            'live_message_id': self.live_message_id,
+            'finished_players': self.finished_players,
+            'ledger': self.ledger.to_dict(),
+            'last_updated': datetime.datetime.now().isoformat()
+        }
+
+    def save_state(self) -> None:
+        """Ставит в очередь сохранение состояния игры"""
+        state = self.state()
+
+        def write():
+            self.storage.save_state(self.game_id, state)
+            status = 'открыта' if state['registration_open'] else 'закрыта'
+            logger.debug(
+                "💾 [%s] Состояние сохранено. Запись: %s",
+                self.game_id, status
+            )
+
+        self.persistence.submit('state', write)
+        self.notify()
+
+    def save_players(self) -> None:
+        """Ставит в очередь полную перезапись списка игроков"""
+        self.persistence.compact()
+
+    def log_change(self, record: Record) -> None:
+        """Ставит в очередь запись изменения списка игроков"""
+        self.persistence.append(record)
+        self.notify()
+
+    def notify(self) -> None:
+        for listener in self.listeners:
+            listener(self)
+
+    def add_player(self, player: Player) -> None:
+        self.players.add(player)
+        self.log_change({'op': 'add', 'player': player})
+
+    def remove_player(self, user_id: str | int) -> Player | None:
+        player = self.players.remove(user_id)
+        if player is not None:
+            self.log_change({'op': 'remove', 'user_id': user_id})
+        return player
+
+    def clear_players(self) -> None:
+        self.players.clear()
+        self.log_change({'op': 'clear'})
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator["GameSession"]:
+        """Атомарный блок проверок и изменений игры.
+
+        С общим хранилищем блок выполняется одной репликой за раз: копия
+        игры сначала обновляется, а изменения записываются до выхода.
+        """
+        async with self.lock:
+            if self.shared is None:
+                yield self
+                return
+            from shared import shared_lock
+            async with shared_lock(
+                self.shared, self.revision_key, self.replica
+            ):
+                await self._refresh()
+                yield self
+                await self.persistence.flush()
+
+    async def refresh(self) -> None:
+        """Перечитывает игру, если её изменила другая реплика"""
+        if self.shared is None:
+            return
+        async with self.lock:
+            await self._refresh()
+
+    async def _refresh(self) -> None:
+        assert self.shared is not None
+        # Своё незаписанное должно попасть в хранилище раньше чтения
+        await self.persistence.flush()
+        revision = await asyncio.to_thread(
+            self.shared.revision, self.revision_key
+        )
+        if revision != self.revision:
+            logger.debug(
+                "🔄 [%s] Ревизия %d -> %d, перечитываем игру",
+                self.game_id, self.revision, revision
+            )
+            await self._load()
+
+    def _take_waiting(self) -> Player | None:
+        """Переводит первого из листа ожидания в список (без журнала)"""
+        if self.is_full:
+            return None
+        first = self.players.first_waiting()
+        if first is None:
+            return None
+        self.players.remove(first['user_id'])
+        player = {k: v for k, v in first.items() if k != 'waiting'}
+        self.players.add(player)
+        return player
+
+    def promote_waiting(self) -> Player | None:
+        """Переводит первого из листа ожидания в список, если есть место"""
+        player = self._take_waiting()
+        if player is None:
+            return None
+        self.log_change({'op': 'remove', 'user_id': player['user_id']})
+        self.log_change({'op': 'add', 'player': player})
+        logger.info(
+            "⏫ [%s] %s переведён из листа ожидания в список",
+            self.game_id, player['user_id']
+        )
+        return player
+
+    async def sign_up(self, player: Player, waitlist: bool = False) -> Signup:
+        """Записывает игрока, если запись открыта и есть места.
+
+        Если мест нет и waitlist=True, ставит игрока в лист ожидания.
+        """
+        async with self.transaction():
+            if not self.registration_open:
+                return Signup.CLOSED
+            if player['user_id'] in self.players:
+                return Signup.DUPLICATE
+            if self.players.is_waiting(player['user_id']):
+                return Signup.WAITLISTED
+            if self.is_full:
+                if not waitlist:
+                    return Signup.FULL
+                self.add_player({**player, 'waiting': True})
+                return Signup.WAITLISTED
+            self.add_player(player)
+            return Signup.OK
+
+    def _withdraw(self, user_id: str | int) -> Withdrawal:
+        removed = self.remove_player(user_id)
+        promoted = None
+        if removed is not None and not removed.get('waiting'):
+            promoted = self.promote_waiting()
+        return Withdrawal(removed, promoted)
+
+    async def withdraw(self, user_id: str | int) -> Withdrawal:
+        """Удаляет игрока из списка или из листа ожидания.
+
+        Освободившееся место сразу занимает первый из листа ожидания.
+        """
+        async with self.transaction():
+            return self._withdraw(user_id)
+
+    async def withdraw_friend(
+        self, friend_id: str, owner_id: int
+    ) -> Withdrawal:
+        """Удаляет друга, если его записал owner_id.
+
+        friend_id - полный friend_id или токен с кнопки.
+        """
+        async with self.transaction():
+            friend = self.players.find_friend(owner_id, friend_id)
+            if friend is None:
+                return Withdrawal(None, None)
+            return self._withdraw(friend['user_id'])
+
+    async def withdraw_friends(self, owner_id: int) -> Batch:
+        """Удаляет всех друзей, записанных owner_id.
+
+        Освободившиеся места занимает лист ожидания. Одна перезапись
+        списка в хранилище и одно уведомление слушателей.
+        """
+        result = Batch([], [], [], [], [])
+        async with self.transaction():
+            for friend in self.players.friends_of(owner_id):
+                self.players.remove(friend['user_id'])
+                result.removed.append(friend)
+            if not result.removed:
+                return result
+            while (promoted := self._take_waiting()) is not None:
+                result.promoted.append(promoted)
+            self.save_players()
+            self.notify()
+        logger.info(
+            "🗑 [%s] %s удалил друзей: %d, переведено из листа ожидания %d",
+            self.game_id, owner_id, len(result.removed), len(result.promoted)
+        )
+        return result
+
+    async def finish_game(self) -> None:
+        """Запоминает состав игры до ответа организатора об оплате"""
+        async with self.transaction():
+            self.finished_players = list(self.players)
+            self.save_state()
+
+    async def cancel_game(self) -> None:
+        """Игра не состоялась: состав в историю не попадает"""
+        async with self.transaction():
+            self.finished_players = None
+            self.save_state()
+
+    async def apply_batch(
+        self,
+        adds: list[Player],
+        removes: list[str],
+        replace: bool = False
+    ) -> Batch:
+        """Атомарно применяет пакет изменений администратора.
+
+        Сначала удаления (по user_id или имени), затем записи: лишние
+        игроки встают в лист ожидания, освободившиеся места занимает лист
+        ожидания. replace=True сначала очищает список. Весь пакет - одна
+        перезапись списка в хранилище и одно уведомление слушателей.
+        Открыта ли запись, не проверяется.
+        """
+        from bulk import find_by_name
+
+        result = Batch([], [], [], [], [])
+        async with self.transaction():
+            if replace:
+                result.removed.extend(self.players.to_list())
+                self.players.clear()
+            for key in removes:
+                player = None
+                if key.lstrip('-').isdigit():
+                    player = self.players.remove(int(key))
+                if player is None:
+                    found = find_by_name(
+                        [*self.players, *self.players.waiting], key
+                    )
+                    if found is not None:
+                        player = self.players.remove(found['user_id'])
+                if player is None:
+                    result.skipped.append(key)
+                    continue
+                result.removed.append(player)
+            for player in adds:
+                user_id = player['user_id']
+                if (user_id in self.players
+                        or self.players.is_waiting(user_id)):
+                    result.skipped.append(str(user_id))
+                    continue
+                if self.is_full and not player.get('waiting'):
+                    player = {**player, 'waiting': True}
+                self.players.add(player)
+                if player.get('waiting'):
+                    result.waitlisted.append(player)
+                else:
+                    result.added.append(player)
+            while (promoted := self._take_waiting()) is not None:
+                result.promoted.append(promoted)
+            self.save_players()
+            self.notify()
+        logger.info(
+            "🛠 [%s] Пакетное изменение: +%d -%d, в лист ожидания %d, "
+            "переведено %d, пропущено %d",
+            self.game_id, len(result.added), len(result.removed),
+            len(result.waitlisted), len(result.promoted), len(result.skipped)
+        )
+        return result
+
+    async def archive_game(self, amount: int) -> None:
+        """Сохраняет сыгранную игру в историю и начисляет оплату.
+
+        amount - сумма с каждого игрока; за друзей платит тот, кто их
+        записал (added_by есть в записи друга).
+        """
+        async with self.transaction():
+            players = (
+                self.finished_players if self.finished_players is not None
+                else list(self.players)
+            )
+            self.ledger.record_game(players, amount)
+            self.finished_players = None
+            self.save_state()
+        entry = {
+            'date': datetime.date.today().isoformat(),
+            'amount': amount,
+            'total': amount * len(players),
+            'players': players
+        }
+        try:
+            await asyncio.to_thread(
+                self.storage.archive_game, self.game_id, entry
+            )
+            logger.info(
+                "📚 [%s] Игра %s сохранена в историю",
+                self.game_id, entry['date']
+            )
+        except Exception as e:
+            logger.error(
+                "❌ [%s] Ошибка сохранения истории игр: %s",
+                self.game_id, e
+            )
+
+    async def record_payment(self, user_id: str, amount: int) -> PlayerStats:
+        """Учитывает оплату игрока и дописывает её в журнал оплат"""
+        async with self.transaction():
+            stats = self.ledger.record_payment(user_id, amount)
+            self.save_state()
+        payment = {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'user_id': user_id,
+            'amount': amount
+        }
+        try:
+            await asyncio.to_thread(
+                self.storage.record_payment, self.game_id, payment
+            )
+            logger.info(
+                "💰 [%s] Оплата %s от %s учтена",
+                self.game_id, amount, user_id
+            )
+        except Exception as e:
+            logger.error(
+                "❌ [%s] Ошибка сохранения оплаты: %s",
+                self.game_id, e
+            )
+        return stats
+
+
+class SessionRegistry:
+    """Все игры процесса и маршрутизация апдейтов к нужной игре.
+
+    Сообщение из группового чата игры попадает в эту игру. В личном чате
+    используется игра, выбранная пользователем, иначе игра по умолчанию.
+    """
+
+    def __init__(
+        self,
+        conversation_ttl: float = 600,
+        conversation_limit: int = 10000,
+        sweep_interval: float = 60
+    ):
+        self._sessions: dict[str, GameSession] = {}
+        self._by_chat: dict[str, GameSession] = {}
+        self._selected: dict[int, str] = {}
+        # Апдейты одного пользователя обрабатываются по очереди
+        self.user_locks = KeyedLocks()
+        self.conversations = Conversations(
+            conversation_ttl, conversation_limit
+        )
+        self.conversations.on_change = self.save_conversations
+        self.sweep_interval = sweep_interval
+        self._sweeper: asyncio.Task | None = None
+        self.shared: "SharedStore | None" = None
+        # Ревизия диалогов, которую отражает память (общее хранилище)
+        self.conversations_revision = 0
+        self._conversations_lock = asyncio.Lock()
+
+    def __iter__(self) -> Iterator[GameSession]:
+        return iter(self._sessions.values())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def default(self) -> GameSession:
+        return self._sessions.get(DEFAULT_GAME) or next(iter(self))
+
+    def add(self, session: GameSession) -> None:
+        if session.game_id in self._sessions:
+            raise ValueError(f"Игра {session.game_id} уже существует")
+        self._sessions[session.game_id] = session
+        self._by_chat.setdefault(session.chat_id, session)
+
+    def get(self, game_id: str) -> GameSession | None:
+        return self._sessions.get(game_id)
+
+    def by_chat(self, chat_id: int | str) -> GameSession | None:
+        return self._by_chat.get(str(chat_id))
+
+    def select(self, user_id: int, game_id: str) -> GameSession | None:
+        """Запоминает игру, с которой пользователь работает в личке"""
+        session = self._sessions.get(game_id)
+        if session is not None:
+            self._selected[user_id] = game_id
+        return session
+
+    def route(self, chat_id: int | str, user_id: int) -> GameSession:
+        session = self.by_chat(chat_id)
+        if session is not None:
+            return session
+        selected = self._selected.get(user_id)
+        if selected is not None and selected in self._sessions:
+            return self._sessions[selected]
+        return self.default
+
+    def share(self, store: "SharedStore", replica: str) -> None:
+        """Включает работу нескольких реплик с общим хранилищем.
+
+        Диалоги тогда записываются по одному пользователю (publish), а
+        не всем списком, чтобы реплики не затирали изменения друг друга.
+        """
+        self.shared = store
+        for session in self._sessions.values():
+            session.share(store, replica)
+        self.conversations.on_change = None
+
+    async def load_all(self) -> None:
+        """Загружает все игры и диалоги одновременно"""
+        if self.shared is not None:
+            self.conversations_revision = await asyncio.to_thread(
+                self.shared.revision, "conversations"
+            )
+        _, entries = await asyncio.gather(
+            asyncio.gather(*(s.load_async() for s in self._sessions.values())),
+            asyncio.to_thread(self.read_conversations)
+        )
+        self.conversations.load(entries)
+        logger.info(
+            "✅ Незавершённых диалогов восстановлено: %s",
+            len(self.conversations)
+        )
+
+    def read_conversations(self) -> list[dict[str, Any]]:
+        try:
+            return self.default.storage.load_conversations()
+        except Exception as e:
+            logger.error("❌ Ошибка загрузки диалогов: %s", e)
+            return []
+
+    def save_conversations(self) -> None:
+        """Ставит в очередь сохранение диалогов.
+
+        Диалоги общие для всех игр и записываются через очередь игры по
+        умолчанию; частые изменения склеиваются в одну запись.
+        """
+        if not self._sessions:
+            return
+        session = self.default
+        entries = self.conversations.to_list()
+        session.persistence.submit(
+            'conversations',
+            lambda: session.storage.save_conversations(entries)
+        )
+
+    async def refresh(self) -> None:
+        """Подтягивает изменения других реплик: игры и диалоги"""
+        if self.shared is None:
+            return
+        await asyncio.gather(
+            *(s.refresh() for s in self._sessions.values()),
+            self._refresh_conversations()
+        )
+
+    async def _refresh_conversations(self) -> None:
+        assert self.shared is not None
+        async with self._conversations_lock:
+            await self._publish()
+            revision = await asyncio.to_thread(
+                self.shared.revision, "conversations"
+            )
+            if revision == self.conversations_revision:
+                return
+            entries = await asyncio.to_thread(self.read_conversations)
+            self.conversations.load(entries)
+            self.conversations_revision = revision
+
+    async def publish(self) -> None:
+        """Записывает изменённые диалоги в общее хранилище"""
+        if self.shared is None:
+            return
+        async with self._conversations_lock:
+            await self._publish()
+
+    async def _publish(self) -> None:
+        assert self.shared is not None
+        changes = self.conversations.take_changes()
+        if not changes:
+            return
+        shared = self.shared
+        storage = self.default.storage
+
+        def write() -> int:
+            storage.update_conversations(changes)
+            return shared.bump("conversations")
+
+        try:
+            revision = await asyncio.to_thread(write)
+        except Exception as e:
+            logger.error("❌ Ошибка сохранения диалогов: %s", e)
+            self.conversations.requeue(changes)
+            return
+        if revision == self.conversations_revision + 1:
+            self.conversations_revision = revision
+
+    def start(self) -> None:
+        for session in self._sessions.values():
+            session.persistence.start()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def flush(self) -> None:
+        """Записывает диалоги и очереди записи всех игр"""
+        await self.publish()
+        await asyncio.gather(
+            *(s.persistence.flush() for s in self._sessions.values())
+        )
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        await self.publish()
+        await asyncio.gather(
+            *(s.persistence.stop() for s in self._sessions.values())
+        )
+
+    async def _sweep(self) -> None:
+        """Периодически удаляет просроченные диалоги"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            expired = self.conversations.sweep()
+            if expired:
+                logger.debug("🧹 Удалено просроченных диалогов: %d", expired)
+                await self.publish()
+
+
+def parse_games(raw: str) -> list[dict[str, Any]]:
+    """Разбирает переменную GAMES: JSON-список описаний игр.
+
+    Пример: [{"id": "wed", "chat_id": "-100123", "max_players": 14,
+    "game_day": "среду"}]
+    """
+    games = json.loads(raw)
+    if not isinstance(games, list):
+        raise ValueError("GAMES должен быть JSON-списком")
+    for game in games:
+        if 'id' not in game or 'chat_id' not in game:
+            raise ValueError("У каждой игры в GAMES нужны id и chat_id")
+    return games
@@ -0,0 +1,257 @@
+"""Общее состояние нескольких реплик бота.
+
+Реплики хранят игроков, состояние игр и диалоги в общем хранилище
+(SQLite на общем томе) и держат копию в памяти. Через SharedStore они
+договариваются о трёх вещах:
+
+- ревизии: каждая запись увеличивает ревизию игры или диалогов, и
+  реплика перечитывает данные, только если ревизия изменилась;
+- блокировки: изменения одной игры выполняются одной репликой за раз;
+- лидер: задачи расписания выполняет только одна реплика.
+"""
+import os
+import abc
+import time
+import socket
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Как часто повторять попытку взять занятую блокировку игры
+LOCK_RETRY = 0.05
+# Блокировка игры освобождается сама, если реплика упала, не отпустив её
+LOCK_TTL = 10.0
+
+
+def default_replica_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedStore(abc.ABC):
+    """Аренды (блокировки с истечением) и счётчики ревизий.
+
+    Методы синхронные и вызываются из пула потоков.
+    """
+
+    @abc.abstractmethod
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт или продлевает аренду name, если она свободна, истекла
+        или уже принадлежит owner"""
+
+    @abc.abstractmethod
+    def release(self, name: str, owner: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def revision(self, key: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    def bump(self, key: str) -> int:
+        """Увеличивает ревизию и возвращает новое значение"""
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(SharedStore):
+    """Общее состояние внутри одного процесса.
+
+    Заменяет внешнее хранилище в проверках и нагрузочном тесте: несколько
+    экземпляров бота в одном процессе ведут себя как отдельные реплики.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: dict[str, tuple[str, float]] = {}
+        self._revisions: dict[str, int] = {}
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def release(self, name: str, owner: str) -> None:
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder is not None and holder[0] == owner:
+                del self._leases[name]
+
+    def revision(self, key: str) -> int:
+        with self._lock:
+            return self._revisions.get(key, 0)
+
+    def bump(self, key: str) -> int:
+        with self._lock:
+            revision = self._revisions[key] = self._revisions.get(key, 0) + 1
+            return revision
+
+
+class SqliteStore(SharedStore):
+    """Общее состояние в файле SQLite, доступном всем репликам.
+
+    Подходит для реплик на одном хосте или на томе с корректными
+    блокировками файлов (не NFS).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS revisions (
+            key TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL
+        );
+    """
+
+    ACQUIRE = (
+        "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET "
+        "owner = excluded.owner, expires = excluded.expires "
+        "WHERE leases.owner = excluded.owner OR leases.expires <= ?"
+    )
+    BUMP = (
+        "INSERT INTO revisions (key, revision) VALUES (?, 1) "
+        "ON CONFLICT (key) DO UPDATE SET revision = revision + 1 "
+        "RETURNING revision"
+    )
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        import sqlite3
+        self._conn = sqlite3.connect(
+            path, timeout=5, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                self.ACQUIRE, (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name: str, owner: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                (name, owner)
+            )
+
+    def revision(self, key: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM revisions WHERE key = ?", (key,)
+            ).fetchone()
+        return 0 if row is None else row[0]
+
+    def bump(self, key: str) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute(self.BUMP, (key,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+@asynccontextmanager
+async def shared_lock(
+    store: SharedStore, name: str, owner: str, ttl: float = LOCK_TTL
+) -> AsyncIterator[None]:
+    """Блокировка, общая для всех реплик"""
+    while not await asyncio.to_thread(store.acquire, name, owner, ttl):
+        await asyncio.sleep(LOCK_RETRY)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(store.release, name, owner)
+
+
+class LeaderElection:
+    """Выбор реплики, которая выполняет задачи расписания.
+
+    Лидер держит аренду и продлевает её каждые ttl/3 секунд. Если лидер
+    упал, аренду через ttl секунд забирает другая реплика. Реплика
+    считает себя лидером, только пока её аренда точно не истекла.
+    on_change вызывается при получении и потере лидерства.
+    """
+
+    def __init__(
+        self,
+        store: SharedStore,
+        owner: str,
+        ttl: float = 30,
+        on_change: Callable[[bool], Awaitable[None]] | None = None,
+        name: str = "leader"
+    ):
+        self.store = store
+        self.owner = owner
+        self.ttl = ttl
+        self.on_change = on_change
+        self.name = name
+        self._leader = False
+        self._valid_until = 0.0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader and time.monotonic() < self._valid_until
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._leader:
+            await self._set(False)
+            # Отдаём аренду сразу, не дожидаясь истечения
+            await asyncio.to_thread(self.store.release, self.name, self.owner)
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                acquired = await asyncio.to_thread(
+                    self.store.acquire, self.name, self.owner, self.ttl
+                )
+            except Exception as e:
+                logger.error("❌ Ошибка продления аренды лидера: %s", e)
+                acquired = False
+            if acquired:
+                self._valid_until = started + self.ttl
+            await self._set(acquired)
+            await asyncio.sleep(self.ttl / 3)
+
+    async def _set(self, leader: bool) -> None:
+        if leader == self._leader:
+            return
+        self._leader = leader
+        if leader:
+            logger.info("👑 Реплика %s стала лидером", self.owner)
+        else:
+            logger.warning("⚠️ Реплика %s больше не лидер", self.owner)
+        if self.on_change is not None:
+            try:
+                await self.on_change(leader)
+            except Exception as e:
+                logger.error("❌ Ошибка смены лидера: %s", e)
@@ -0,0 +1,599 @@
+import os
+import abc
+import json
+import logging
+import datetime
+import threading
+from typing import IO, Any, Iterator
+
+from roster import Roster, Player
+
+logger = logging.getLogger(__name__)
+
+Record = dict[str, Any]
+
+DEFAULT_GAME = "default"
+
+
+def write_json_atomic(path: str, data: Any, **dump_kwargs) -> None:
+    """Записывает JSON через временный файл и rename.
+
+    При падении процесса на диске остаётся либо старая, либо новая версия
+    файла, но никогда не обрезанная.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(directory)
+
+
+def _fsync_dir(directory: str) -> None:
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def apply_record(roster: Roster, record: Record) -> None:
+    """Применяет запись журнала к списку игроков.
+
+    Применение идемпотентно: повторное проигрывание хвоста журнала поверх
+    уже сжатого снимка даёт то же состояние.
+    """
+    op = record.get('op')
+    if op == 'add':
+        player = record['player']
+        user_id = player['user_id']
+        if user_id not in roster and not roster.is_waiting(user_id):
+            roster.add(player)
+    elif op == 'remove':
+        roster.remove(record['user_id'])
+    elif op == 'clear':
+        roster.clear()
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {op!r}")
+
+
+class PlayerJournal:
+    """Снимок списка игроков плюс журнал изменений (write-ahead log).
+
+    Каждое изменение дописывается в журнал одной строкой JSON с fsync, так
+    что стоимость записи пропорциональна изменению, а не размеру списка.
+    Периодически журнал сжимается: текущий список атомарно записывается в
+    снимок, а журнал обнуляется. При старте снимок загружается и поверх него
+    проигрывается хвост журнала.
+    """
+
+    def __init__(self, snapshot_path: str, compact_every: int = 200):
+        self.snapshot_path = snapshot_path
+        self.wal_path = f"{snapshot_path}.wal"
+        self.compact_every = compact_every
+        self._records = 0
+        self._wal: IO[str] | None = None
+
+    @property
+    def pending_records(self) -> int:
+        """Число записей журнала с момента последнего сжатия"""
+        return self._records
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._records >= self.compact_every
+
+    def load(self, roster: Roster) -> None:
+        """Загружает снимок и проигрывает журнал в roster"""
+        roster.replace(self._read_snapshot())
+        replayed = self._replay(roster)
+        if replayed:
+            logger.info("📜 Проиграно записей журнала: %d", replayed)
+            # Сворачиваем журнал сразу, заодно отрезая оборванную строку
+            self.compact(roster.to_list())
+
+    def append(self, record: Record) -> None:
+        """Дописывает одну запись в журнал и сбрасывает её на диск"""
+        self.append_many([record])
+
+    def append_many(self, records: list[Record]) -> None:
+        if not records:
+            return
+        if self._wal is None:
+            os.makedirs(
+                os.path.dirname(self.wal_path) or ".", exist_ok=True
+            )
+            self._wal = open(self.wal_path, "a", encoding="utf-8")
+        self._wal.write("".join(
+            json.dumps(r, ensure_ascii=False) + "\n" for r in records
+        ))
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self._records += len(records)
+
+    def compact(self, players: list[Player]) -> None:
+        """Атомарно записывает снимок и обнуляет журнал"""
+        write_json_atomic(self.snapshot_path, players)
+        self.close()
+        with open(self.wal_path, "w", encoding="utf-8") as f:
+            os.fsync(f.fileno())
+        self._records = 0
+        logger.debug("🗜 Журнал игроков сжат. Всего: %d", len(players))
+
+    def close(self) -> None:
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _read_snapshot(self) -> list[Any]:
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            logger.info("📭 Файл игроков не найден, создаем пустой список")
+            return []
+        except ValueError as e:
+            # Не затираем повреждённый файл, а откладываем его в сторону
+            stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+            backup = f"{self.snapshot_path}.corrupt-{stamp}"
+            os.replace(self.snapshot_path, backup)
+            logger.error(
+                "❌ Снимок игроков повреждён (%s), сохранён как %s",
+                e, backup
+            )
+            return []
+
+    def _replay(self, roster: Roster) -> int:
+        try:
+            f = open(self.wal_path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return 0
+        replayed = 0
+        with f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя запись после падения
+                    logger.warning(
+                        "⚠️ Пропущена повреждённая запись журнала "
+                        "(строка %d)", line_no
+                    )
+                    continue
+                apply_record(roster, record)
+                replayed += 1
+        self._records = replayed
+        return replayed
+
+
+def game_path(path: str, game: str) -> str:
+    """Путь к файлу игры: у игры по умолчанию остаются прежние имена"""
+    if game == DEFAULT_GAME:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{game}{ext}"
+
+
+class StorageBackend(abc.ABC):
+    """Хранилище игроков, состояния бота и истории игр.
+
+    Все методы синхронные и вызываются из пула потоков фоновой записи
+    или при старте, до запуска обработчиков. Бэкенд без какого-либо из
+    абстрактных методов не создаётся.
+    """
+
+    @abc.abstractmethod
+    def load_players(self, game: str, roster: Roster) -> None:
+        ...
+
+    @abc.abstractmethod
+    def append_changes(self, game: str, records: list[Record]) -> None:
+        """Записывает изменения списка игроков"""
+
+    @abc.abstractmethod
+    def write_players(self, game: str, players: list[Player]) -> None:
+        """Полностью перезаписывает список игроков"""
+
+    def should_compact(self, game: str, pending: int) -> bool:
+        """Нужно ли вместо изменений записать список целиком"""
+        return False
+
+    @abc.abstractmethod
+    def load_state(self, game: str) -> dict[str, Any] | None:
+        """Состояние бота или None, если оно ещё не сохранялось"""
+
+    @abc.abstractmethod
+    def save_state(self, game: str, state: dict[str, Any]) -> None:
+        ...
+
+    @abc.abstractmethod
+    def load_conversations(self) -> list[dict[str, Any]]:
+        """Незавершённые диалоги пользователей"""
+
+    @abc.abstractmethod
+    def save_conversations(self, entries: list[dict[str, Any]]) -> None:
+        """Полностью перезаписывает незавершённые диалоги"""
+
+    def update_conversations(
+        self, changes: dict[int, dict[str, Any] | None]
+    ) -> None:
+        """Записывает диалоги отдельных пользователей (None - удалить).
+
+        Нужно репликам с общим хранилищем, чтобы не затирать диалоги,
+        изменённые другими репликами. По умолчанию диалоги перечитываются
+        и перезаписываются целиком.
+        """
+        entries = {
+            entry.get('user_id'): entry
+            for entry in self.load_conversations()
+        }
+        for user_id, entry in changes.items():
+            if entry is None:
+                entries.pop(user_id, None)
+            else:
+                entries[user_id] = entry
+        self.save_conversations(list(entries.values()))
+
+    @abc.abstractmethod
+    def archive_game(self, game: str, entry: dict[str, Any]) -> None:
+        """Добавляет сыгранную игру в историю"""
+
+    @abc.abstractmethod
+    def game_history(self, game: str, limit: int = 10) -> list[dict]:
+        """Последние игры, начиная с самой свежей"""
+
+    @abc.abstractmethod
+    def iter_history(self, game: str) -> Iterator[dict[str, Any]]:
+        """Все игры по порядку, без чтения истории в память целиком"""
+
+    @abc.abstractmethod
+    def record_payment(self, game: str, payment: dict[str, Any]) -> None:
+        """Добавляет оплату в журнал оплат"""
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(StorageBackend):
+    """JSON-файлы: снимок с журналом для игроков, файл состояния, история
+    игр и журнал оплат в формате JSON Lines."""
+
+    def __init__(
+        self,
+        data_file: str,
+        state_file: str,
+        history_file: str,
+        conversations_file: str,
+        payments_file: str
+    ):
+        self.data_file = data_file
+        self.state_file = state_file
+        self.history_file = history_file
+        self.conversations_file = conversations_file
+        self.payments_file = payments_file
+        self._journals: dict[str, PlayerJournal] = {}
+
+    def journal(self, game: str) -> PlayerJournal:
+        if game not in self._journals:
+            self._journals[game] = PlayerJournal(
+                game_path(self.data_file, game)
+            )
+        return self._journals[game]
+
+    def load_players(self, game: str, roster: Roster) -> None:
+        self.journal(game).load(roster)
+
+    def append_changes(self, game: str, records: list[Record]) -> None:
+        self.journal(game).append_many(records)
+
+    def write_players(self, game: str, players: list[Player]) -> None:
+        self.journal(game).compact(players)
+
+    def should_compact(self, game: str, pending: int) -> bool:
+        journal = self.journal(game)
+        return journal.pending_records + pending >= journal.compact_every
+
+    def load_state(self, game: str) -> dict[str, Any] | None:
+        try:
+            with open(game_path(self.state_file, game), "r",
+                      encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, game: str, state: dict[str, Any]) -> None:
+        write_json_atomic(game_path(self.state_file, game), state, indent=2)
+
+    def load_conversations(self) -> list[dict[str, Any]]:
+        try:
+            with open(self.conversations_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def save_conversations(self, entries: list[dict[str, Any]]) -> None:
+        write_json_atomic(self.conversations_file, entries)
+
+    def archive_game(self, game: str, entry: dict[str, Any]) -> None:
+        self._append_line(game_path(self.history_file, game), entry)
+
+    def game_history(self, game: str, limit: int = 10) -> list[dict]:
+        try:
+            with open(game_path(self.history_file, game), "r",
+                      encoding="utf-8") as f:
+                lines = f.readlines()[-limit:]
+        except FileNotFoundError:
+            return []
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+    def iter_history(self, game: str) -> Iterator[dict[str, Any]]:
+        try:
+            f = open(game_path(self.history_file, game), "r",
+                     encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def record_payment(self, game: str, payment: dict[str, Any]) -> None:
+        self._append_line(game_path(self.payments_file, game), payment)
+
+    def close(self) -> None:
+        for journal in self._journals.values():
+            journal.close()
+
+    @staticmethod
+    def _append_line(path: str, entry: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class SqliteStorage(StorageBackend):
+    """Один файл SQLite на развёртывание (WAL, индексы по user_id,
+    added_by и игре).
+
+    Соединение общее для всех потоков, поэтому обращения к нему
+    сериализуются блокировкой.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            game TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            user_id NOT NULL,
+            friend_id TEXT,
+            added_by INTEGER,
+            data TEXT NOT NULL,
+            PRIMARY KEY (game, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS players_position
+            ON players (game, position);
+        CREATE INDEX IF NOT EXISTS players_added_by
+            ON players (game, added_by);
+        CREATE INDEX IF NOT EXISTS players_friend_id
+            ON players (friend_id);
+        CREATE TABLE IF NOT EXISTS state (
+            game TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game TEXT NOT NULL,
+            played_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS games_game ON games (game, id);
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_id INTEGER PRIMARY KEY,
+            game TEXT NOT NULL,
+            step TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            paid_at TEXT NOT NULL,
+            amount INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS payments_user
+            ON payments (game, user_id);
+    """
+
+    INSERT_PLAYER = (
+        "INSERT OR IGNORE INTO players "
+        "(game, position, user_id, friend_id, added_by, data) "
+        "VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM players "
+        "WHERE game = ?), ?, ?, ?, ?)"
+    )
+    DELETE_PLAYER = "DELETE FROM players WHERE game = ? AND user_id = ?"
+    CLEAR_PLAYERS = "DELETE FROM players WHERE game = ?"
+    SELECT_PLAYERS = (
+        "SELECT data FROM players WHERE game = ? ORDER BY position"
+    )
+    UPSERT_STATE = (
+        "INSERT INTO state (game, data) VALUES (?, ?) "
+        "ON CONFLICT (game) DO UPDATE SET data = excluded.data"
+    )
+    SELECT_STATE = "SELECT data FROM state WHERE game = ?"
+    INSERT_GAME = (
+        "INSERT INTO games (game, played_at, data) VALUES (?, ?, ?)"
+    )
+    SELECT_GAMES = (
+        "SELECT data FROM games WHERE game = ? ORDER BY id DESC LIMIT ?"
+    )
+    SELECT_GAMES_AFTER = (
+        "SELECT id, data FROM games WHERE game = ? AND id > ? "
+        "ORDER BY id LIMIT ?"
+    )
+    # Сколько игр читать за одно взятие блокировки при выгрузке истории
+    HISTORY_CHUNK = 200
+    INSERT_CONVERSATION = (
+        "INSERT INTO conversations (user_id, game, step, expires) "
+        "VALUES (:user_id, :game, :step, :expires)"
+    )
+    INSERT_PAYMENT = (
+        "INSERT INTO payments (game, user_id, paid_at, amount) "
+        "VALUES (:game, :user_id, :date, :amount)"
+    )
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # sqlite3 нужен только этому хранилищу
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def load_players(self, game: str, roster: Roster) -> None:
+        with self._lock:
+            rows = self._conn.execute(self.SELECT_PLAYERS, (game,))
+            roster.replace(json.loads(data) for (data,) in rows)
+
+    def append_changes(self, game: str, records: list[Record]) -> None:
+        with self._lock, self._conn:
+            for record in records:
+                op = record.get('op')
+                if op == 'add':
+                    self._insert(game, record['player'])
+                elif op == 'remove':
+                    self._conn.execute(
+                        self.DELETE_PLAYER, (game, record['user_id'])
+                    )
+                elif op == 'clear':
+                    self._conn.execute(self.CLEAR_PLAYERS, (game,))
+                else:
+                    raise ValueError(f"Неизвестная операция журнала: {op!r}")
+
+    def write_players(self, game: str, players: list[Player]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(self.CLEAR_PLAYERS, (game,))
+            for player in players:
+                self._insert(game, player)
+
+    def load_state(self, game: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(self.SELECT_STATE, (game,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save_state(self, game: str, state: dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                self.UPSERT_STATE,
+                (game, json.dumps(state, ensure_ascii=False))
+            )
+
+    def load_conversations(self) -> list[dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, game, step, expires FROM conversations "
+                "ORDER BY rowid"
+            ).fetchall()
+        return [
+            {'user_id': user_id, 'game': game, 'step': step,
+             'expires': expires}
+            for user_id, game, step, expires in rows
+        ]
+
+    def save_conversations(self, entries: list[dict[str, Any]]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM conversations")
+            self._conn.executemany(self.INSERT_CONVERSATION, entries)
+
+    def update_conversations(
+        self, changes: dict[int, dict[str, Any] | None]
+    ) -> None:
+        with self._lock, self._conn:
+            for user_id, entry in changes.items():
+                self._conn.execute(
+                    "DELETE FROM conversations WHERE user_id = ?",
+                    (user_id,)
+                )
+                if entry is not None:
+                    self._conn.execute(self.INSERT_CONVERSATION, entry)
+
+    def archive_game(self, game: str, entry: dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(self.INSERT_GAME, (
+                game, entry.get('date', ''),
+                json.dumps(entry, ensure_ascii=False)
+            ))
+
+    def game_history(self, game: str, limit: int = 10) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                self.SELECT_GAMES, (game, limit)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def iter_history(self, game: str) -> Iterator[dict[str, Any]]:
+        # Читаем частями и отпускаем блокировку между ними: медленная или
+        # брошенная выгрузка не должна останавливать запись
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    self.SELECT_GAMES_AFTER,
+                    (game, last_id, self.HISTORY_CHUNK)
+                ).fetchall()
+            for _, data in rows:
+                yield json.loads(data)
+            if len(rows) < self.HISTORY_CHUNK:
+                return
+            last_id = rows[-1][0]
+
+    def record_payment(self, game: str, payment: dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                self.INSERT_PAYMENT, {**payment, 'game': game}
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _insert(self, game: str, player: Player) -> None:
+        self._conn.execute(self.INSERT_PLAYER, (
+            game, game, player['user_id'], player.get('friend_id'),
+            player.get('added_by'), json.dumps(player, ensure_ascii=False)
+        ))
+
+
+def create_storage(
+    backend: str,
+    data_file: str,
+    state_file: str,
+    history_file: str,
+    sqlite_file: str,
+    conversations_file: str,
+    payments_file: str
+) -> StorageBackend:
+    """Создаёт хранилище по имени из переменной STORAGE_BACKEND"""
+    if backend == "json":
+        return JsonStorage(
+            data_file, state_file, history_file, conversations_file,
+            payments_file
+        )
+    if backend == "sqlite":
+        return SqliteStorage(sqlite_file)
+    raise ValueError(
+        f"Неизвестный STORAGE_BACKEND: {backend!r} (ожидается json или sqlite)"
+    )
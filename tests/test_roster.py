@@ -0,0 +1,79 @@
+import unittest
+
+from roster import CALLBACK_DATA_LIMIT, Roster, friend_callback_data
+
+OWNER = 42
+# Самый длинный допустимый идентификатор игры (GAME_ID_RE)
+LONGEST_GAME = "g" * 16
+
+
+def friend(friend_id):
+    return {
+        'user_id': f"friend_{friend_id}",
+        'friend_id': friend_id,
+        'first_name': "Друг",
+        'last_name': '',
+        'is_friend': True,
+        'added_by': OWNER
+    }
+
+
+def parse(data):
+    """Разбор как в delete_friend_callback: игра, страница, токен"""
+    parts = data[len("del_friend:"):].split(":")
+    page = int(parts[1]) if len(parts) > 2 and parts[1].isdigit() else 0
+    return parts[0], page, parts[-1]
+
+
+class FriendCallbackDataTest(unittest.TestCase):
+    def setUp(self):
+        # UUID, различающиеся только последней цифрой: токены по 32 символа
+        self.ids = [
+            "12345678-1234-1234-1234-12345678901" + digit
+            for digit in "ab"
+        ]
+        self.roster = Roster(friend(friend_id) for friend_id in self.ids)
+        self.tokens = self.roster.friend_tokens(OWNER)
+
+    def test_longest_token(self):
+        self.assertEqual(
+            [len(token) for token in self.tokens.values()], [32, 32]
+        )
+
+    def test_fits_with_page(self):
+        for friend_id in self.ids:
+            data = friend_callback_data(
+                LONGEST_GAME, 99, self.tokens[friend_id]
+            )
+            self.assertLessEqual(len(data.encode()), CALLBACK_DATA_LIMIT)
+            game_id, page, token = parse(data)
+            self.assertEqual((game_id, page), (LONGEST_GAME, 99))
+            found = self.roster.find_friend(OWNER, token)
+            self.assertEqual(found and found['friend_id'], friend_id)
+
+    def test_long_page_is_dropped(self):
+        for friend_id in self.ids:
+            data = friend_callback_data(
+                LONGEST_GAME, 12345, self.tokens[friend_id]
+            )
+            self.assertLessEqual(len(data.encode()), CALLBACK_DATA_LIMIT)
+            game_id, page, token = parse(data)
+            self.assertEqual((game_id, page), (LONGEST_GAME, 0))
+            found = self.roster.find_friend(OWNER, token)
+            self.assertEqual(found and found['friend_id'], friend_id)
+
+    def test_long_legacy_id_never_matches_other_friend(self):
+        ids = ["f" * 60 + "1", "f" * 60 + "2"]
+        roster = Roster(friend(friend_id) for friend_id in ids)
+        for friend_id, full in roster.friend_tokens(OWNER).items():
+            data = friend_callback_data(LONGEST_GAME, 0, full)
+            self.assertLessEqual(len(data.encode()), CALLBACK_DATA_LIMIT)
+            self.assertIsNone(roster.find_friend(OWNER, parse(data)[2]))
+
+    def test_too_long_game_id(self):
+        with self.assertRaises(ValueError):
+            friend_callback_data("g" * 60, 0, "0" * 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import asyncio
+import datetime
+import unittest
+
+from scheduler import Job, Scheduler, WeeklyRule
+
+
+def overdue_job(name, action, on_fired=None):
+    """Задача, срабатывание которой было минуту назад и ещё не выполнено"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    moment = now - datetime.timedelta(minutes=1)
+    rule = WeeklyRule.parse(f"daily {moment:%H:%M}")
+    previous = rule.previous(now)
+    return Job(
+        name, rule, action,
+        last_fired=previous - datetime.timedelta(days=1),
+        on_fired=on_fired
+    )
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failing_on_fired_does_not_stop_scheduler(self):
+        scheduler = Scheduler(datetime.timezone.utc)
+        fired = []
+        first_done = asyncio.Event()
+        second_done = asyncio.Event()
+
+        async def broken_on_fired(moment):
+            raise RuntimeError("database is locked")
+
+        async def first():
+            fired.append("first")
+            first_done.set()
+
+        async def second():
+            fired.append("second")
+            second_done.set()
+
+        scheduler.add(overdue_job("first", first, broken_on_fired))
+        scheduler.start()
+        try:
+            with self.assertLogs("scheduler", "ERROR"):
+                await asyncio.wait_for(first_done.wait(), timeout=5)
+            # Задача, добавленная позже, тоже выполняется
+            scheduler.add(overdue_job("second", second, broken_on_fired))
+            await asyncio.wait_for(second_done.wait(), timeout=5)
+            self.assertFalse(scheduler._task.done())
+        finally:
+            await scheduler.stop()
+        self.assertEqual(fired, ["first", "second"])
+
+
+if __name__ == "__main__":
+    unittest.main()
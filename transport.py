@@ -0,0 +1,120 @@
+"""HTTP-транспорт к Bot API.
+
+Два пула соединений: один для getUpdates, другой для остальных вызовов.
+Длинный опрос держит соединение до POLLING_TIMEOUT секунд, и в общем
+пуле ответы пользователям ждали бы освобождения соединения. Соединения
+переиспользуются (keep-alive), HTTP/2 включается, если установлен пакет
+h2. Время каждого запроса записывается в метрику по методу Bot API.
+"""
+import time
+import logging
+from importlib.util import find_spec
+from typing import Any
+
+import httpx
+from telegram.request import BaseRequest, HTTPXRequest
+
+from metrics import BOT_API_ERRORS, BOT_API_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_http_version(requested: str) -> str:
+    """HTTP/2 требует пакет h2; без него остаёмся на HTTP/1.1"""
+    if requested not in ("1.1", "2"):
+        raise ValueError(
+            f"Неизвестная версия HTTP: {requested!r} (ожидается 1.1 или 2)"
+        )
+    if requested == "2" and find_spec("h2") is None:
+        logger.warning(
+            "⚠️ HTTP/2 недоступен без пакета h2 "
+            "(pip install 'httpx[http2]'), используется HTTP/1.1"
+        )
+        return "1.1"
+    return requested
+
+
+class BotApiRequest(HTTPXRequest):
+    """HTTPXRequest с настраиваемым keep-alive и замером запросов.
+
+    pool - имя пула для метрик (polling или outbound).
+    """
+
+    def __init__(self, pool: str, keepalive: float = 30.0, **kwargs: Any):
+        self.pool = pool
+        self.keepalive = keepalive
+        super().__init__(**kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits: Any = self._client_kwargs["limits"]
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self.keepalive
+        )
+        return super()._build_client()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Any = None,
+        read_timeout: Any = BaseRequest.DEFAULT_NONE,
+        write_timeout: Any = BaseRequest.DEFAULT_NONE,
+        connect_timeout: Any = BaseRequest.DEFAULT_NONE,
+        pool_timeout: Any = BaseRequest.DEFAULT_NONE
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await super().do_request(
+                url, method, request_data, read_timeout, write_timeout,
+                connect_timeout, pool_timeout
+            )
+        except Exception as e:
+            BOT_API_ERRORS.inc(
+                endpoint=endpoint, pool=self.pool, error=type(e).__name__
+            )
+            raise
+        finally:
+            BOT_API_SECONDS.observe(
+                time.perf_counter() - started,
+                endpoint=endpoint, pool=self.pool
+            )
+
+
+def create_requests(
+    pool_size: int = 64,
+    polling_pool_size: int = 1,
+    http_version: str = "1.1",
+    keepalive: float = 30.0,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 5.0,
+    write_timeout: float = 5.0,
+    pool_timeout: float = 5.0
+) -> tuple[BotApiRequest, BotApiRequest]:
+    """Транспорт для обычных вызовов и отдельный - для getUpdates.
+
+    Таймаут чтения getUpdates библиотека сама увеличивает на время
+    длинного опроса.
+    """
+    version = resolve_http_version(http_version)
+    settings: dict[str, Any] = {
+        'http_version': version,
+        'keepalive': keepalive,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'write_timeout': write_timeout,
+        'pool_timeout': pool_timeout,
+    }
+    outbound = BotApiRequest(
+        "outbound", connection_pool_size=pool_size, **settings
+    )
+    polling = BotApiRequest(
+        "polling", connection_pool_size=polling_pool_size, **settings
+    )
+    logger.info(
+        "🔌 Bot API: HTTP/%s, пул %d соединений, для getUpdates - %d, "
+        "keep-alive %s с", version, pool_size, polling_pool_size, keepalive
+    )
+    return outbound, polling
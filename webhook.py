@@ -0,0 +1,75 @@
+import hmac
+import logging
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Встроенный HTTP-сервер, принимающий апдейты от Telegram.
+
+    Сервер слушает обычный HTTP и рассчитан на работу за reverse proxy,
+    который терминирует TLS. Каждый запрос проверяется по секретному
+    токену из заголовка X-Telegram-Bot-Api-Secret-Token, после чего
+    апдейт кладётся в очередь приложения, как при polling.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        secret_token: str,
+        path: str = "/telegram",
+        host: str = "0.0.0.0",
+        port: int = 8080
+    ):
+        self.application = application
+        self.secret_token = secret_token
+        self.path = path
+        self.host = host
+        self.port = port
+        self.web_app = web.Application()
+        self.web_app.router.add_post(path, self.handle_update)
+        self._runner: web.AppRunner | None = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        # Байты, а не str: compare_digest не сравнивает строки с не-ASCII
+        # символами, и такой заголовок дал бы 500 вместо 403
+        if not hmac.compare_digest(
+            token.encode("utf-8", "surrogateescape"),
+            self.secret_token.encode()
+        ):
+            logger.warning(
+                "⚠️ Webhook: неверный секретный токен от %s", request.remote
+            )
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.warning("⚠️ Webhook: некорректный апдейт: %s", e)
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(
+            "🌐 Webhook-сервер слушает %s:%s%s",
+            self.host, self.port, self.path
+        )
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None